@@ -0,0 +1,311 @@
+"""Throughput benchmark for TelegramAnalyzer.analyze_group on synthetic groups.
+
+Runs the full analysis against a stand-in client that serves generated
+Telethon messages, so no account or network is needed:
+
+    python benchmark.py --sizes 10000 100000 1000000 --json bench.json
+"""
+from telethon.tl.types import (
+    Message, PeerUser, PeerChannel, MessageReplyHeader, MessageFwdHeader,
+    MessageMediaPhoto, MessageMediaDocument, Photo, PhotoSize, Document,
+    DocumentAttributeVideo, DocumentAttributeAudio, DocumentAttributeSticker,
+    DocumentAttributeFilename, InputStickerSetEmpty,
+    MessageEntityHashtag, MessageEntityMention, MessageEntityUrl,
+    MessageReactions, ReactionCount, ReactionEmoji
+)
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from rich.console import Console
+from rich.table import Table
+import multiprocessing
+import tempfile
+import argparse
+import asyncio
+import random
+import json
+
+WORDS = {
+    'en': "the group message meeting today price update release check thanks please news good bad great "
+          "really think people time work project question answer help event market link video".split(),
+    'ru': "привет группа сообщение сегодня цена новости спасибо пожалуйста хорошо плохо вопрос ответ "
+          "работа проект время люди встреча видео ссылка рынок помощь".split(),
+    'de': "hallo gruppe nachricht heute preis neuigkeiten danke bitte gut schlecht frage antwort arbeit "
+          "projekt zeit leute treffen video link markt hilfe".split(),
+    'es': "hola grupo mensaje hoy precio noticias gracias por favor bueno malo pregunta respuesta trabajo "
+          "proyecto tiempo gente reunión video enlace mercado ayuda".split(),
+}
+EMOJI = ['😀', '👍', '🔥', '❤️', '😂', '🎉', '👍🏽', '👨‍👩‍👧', '🇩🇪', '🏳️‍🌈']
+DOMAINS = ['example.com', 't.me', 'youtube.com', 'github.com', 'news.example.org']
+REACTIONS = ['👍', '❤', '🔥', '😂']
+START_DATE = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+def _utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+class MessageGenerator:
+    """Deterministic synthetic group history; message ids run from 1 to count"""
+
+    def __init__(self, count, reply_ratio=0.3, forward_ratio=0.05, reaction_ratio=0.1,
+                 media_mix=None, url_density=0.05, hashtag_density=0.05, mention_density=0.05,
+                 emoji_density=0.1, language='en', users=1000, seed=0):
+        self.count = count
+        self.reply_ratio = reply_ratio
+        self.forward_ratio = forward_ratio
+        self.reaction_ratio = reaction_ratio
+        self.media_mix = media_mix if media_mix is not None else {
+            'photo': 0.1, 'video': 0.03, 'voice': 0.02, 'sticker': 0.03, 'document': 0.02
+        }
+        self.url_density = url_density
+        self.hashtag_density = hashtag_density
+        self.mention_density = mention_density
+        self.emoji_density = emoji_density
+        self.languages = list(WORDS) if language == 'mixed' else [language]
+        self.users = users
+        self.seed = seed
+        # Spread the history over roughly two years
+        self.step = timedelta(seconds=max(1, 2 * 365 * 24 * 3600 // max(count, 1)))
+
+    def message(self, message_id):
+        """Build the message with the given id"""
+        rnd = random.Random(self.seed * 1_000_003 + message_id)
+        sender = rnd.randint(1, self.users)
+        date = START_DATE + self.step * message_id
+        text, entities = self._text(rnd)
+
+        media = self._media(rnd, message_id, date)
+        if media is not None and rnd.random() < 0.5:
+            text, entities = '', []
+
+        reply_to = None
+        if message_id > 1 and rnd.random() < self.reply_ratio:
+            reply_to = MessageReplyHeader(reply_to_msg_id=rnd.randint(max(1, message_id - 500), message_id - 1))
+
+        fwd_from = None
+        if rnd.random() < self.forward_ratio:
+            fwd_from = MessageFwdHeader(date=date, from_id=PeerUser(rnd.randint(1, self.users)))
+
+        reactions = None
+        if rnd.random() < self.reaction_ratio:
+            reactions = MessageReactions(results=[
+                ReactionCount(reaction=ReactionEmoji(emoticon), count=rnd.randint(1, 20))
+                for emoticon in rnd.sample(REACTIONS, rnd.randint(1, 3))
+            ])
+
+        return Message(
+            id=message_id, peer_id=PeerChannel(1), date=date, message=text,
+            from_id=PeerUser(sender), reply_to=reply_to, fwd_from=fwd_from,
+            media=media, entities=entities or None, reactions=reactions
+        )
+
+    def _text(self, rnd):
+        parts = []
+        entities = []
+        offset = 0
+        words = WORDS[rnd.choice(self.languages)]
+        for _ in range(rnd.randint(3, 25)):
+            roll = rnd.random()
+            if roll < self.url_density:
+                token = f"https://{rnd.choice(DOMAINS)}/{rnd.randint(1, 10 ** 6)}"
+                entities.append(MessageEntityUrl(offset, _utf16_len(token)))
+            elif roll < self.url_density + self.hashtag_density:
+                token = f"#{rnd.choice(words)}"
+                entities.append(MessageEntityHashtag(offset, _utf16_len(token)))
+            elif roll < self.url_density + self.hashtag_density + self.mention_density:
+                token = f"@user{rnd.randint(1, self.users)}"
+                entities.append(MessageEntityMention(offset, _utf16_len(token)))
+            elif roll < self.url_density + self.hashtag_density + self.mention_density + self.emoji_density:
+                token = rnd.choice(EMOJI)
+            else:
+                token = rnd.choice(words)
+            parts.append(token)
+            offset += _utf16_len(token) + 1
+        return ' '.join(parts), entities
+
+    def _media(self, rnd, message_id, date):
+        roll = rnd.random()
+        for kind, share in self.media_mix.items():
+            if roll < share:
+                break
+            roll -= share
+        else:
+            return None
+
+        if kind == 'photo':
+            size = rnd.randint(20_000, 2_000_000)
+            return MessageMediaPhoto(photo=Photo(
+                id=message_id, access_hash=0, file_reference=b'', date=date, dc_id=1,
+                sizes=[PhotoSize(type='x', w=1280, h=720, size=size)]
+            ))
+
+        attributes = {
+            'video': [DocumentAttributeVideo(duration=rnd.randint(1, 600), w=1280, h=720),
+                      DocumentAttributeFilename('video.mp4')],
+            'voice': [DocumentAttributeAudio(duration=rnd.randint(1, 180), voice=True)],
+            'sticker': [DocumentAttributeSticker(alt='🙂', stickerset=InputStickerSetEmpty())],
+            'document': [DocumentAttributeFilename('report.pdf')],
+        }[kind]
+        mime_type = {'video': 'video/mp4', 'voice': 'audio/ogg', 'sticker': 'image/webp',
+                     'document': 'application/pdf'}[kind]
+        return MessageMediaDocument(document=Document(
+            id=message_id, access_hash=0, file_reference=b'', date=date, dc_id=1,
+            mime_type=mime_type, size=rnd.randint(10_000, 50_000_000), attributes=attributes
+        ))
+
+
+class FakeClient:
+    """Stand-in for TelegramClient serving a MessageGenerator's history"""
+
+    def __init__(self, generator, members=200, latency=0.0):
+        self.generator = generator
+        self.members = members
+        # Seconds of simulated network round trip per request
+        self.latency = latency
+        self.requests = 0
+
+    async def get_messages(self, entity, limit=None, offset_date=None, **kwargs):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        top_id = self.generator.count
+        if offset_date is not None:
+            # Dates grow with the id: the newest message sent before offset_date
+            top_id = max(0, min(top_id, -(-(offset_date - START_DATE) // self.generator.step) - 1))
+        return [self.generator.message(top_id)][:limit] if top_id else []
+
+    async def iter_messages(self, entity, limit=None, offset_date=None, offset_id=0, max_id=0,
+                            min_id=0, reverse=False, **kwargs):
+        high = self.generator.count
+        if max_id:
+            high = min(high, max_id - 1)
+        if offset_id and not reverse:
+            high = min(high, offset_id - 1)
+        low = max(min_id, offset_id if reverse else 0) + 1
+        ids = range(low, high + 1) if reverse else range(high, low - 1, -1)
+        if limit is not None:
+            ids = ids[:limit]
+
+        for index, message_id in enumerate(ids):
+            # Telegram pages history 100 messages per request
+            if index % 100 == 0:
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+            yield self.generator.message(message_id)
+
+    async def iter_participants(self, entity):
+        for user_id in range(1, self.members + 1):
+            yield SimpleNamespace(
+                id=user_id, username=f"user{user_id}", first_name=f"User {user_id}", last_name=None,
+                phone=None, bot=user_id % 50 == 0, verified=False, status=None
+            )
+
+    async def get_entity(self, user_id):
+        return SimpleNamespace(id=user_id)
+
+    async def get_profile_photos(self, user):
+        return SimpleNamespace(total=0)
+
+    async def get_common_chats(self, user):
+        return []
+
+
+def run_benchmark(count, use_store=False, charts=False, generator_options=None, shards=1, latency=0.0,
+                  analysis_workers=0):
+    """Analyze one synthetic group of `count` messages and return its measurements"""
+    from main import TelegramAnalyzer, RunMetrics
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Unthrottled: the benchmark measures the pipeline, not the API rate limit
+        analyzer = TelegramAnalyzer(None, None, None, use_store=use_store, output_dir=output_dir, rate_limit=None,
+                                    checkpoint_interval=None, shards=shards,
+                                    pipeline_options={'workers': analysis_workers} if analysis_workers else None)
+        analyzer.console = Console(quiet=True)
+        analyzer.client = FakeClient(MessageGenerator(count, **(generator_options or {})), latency=latency)
+        if not charts:
+            analyzer._generate_visualizations = lambda *args: asyncio.sleep(0)
+
+        group = SimpleNamespace(id=1, title=f"bench_{count}")
+        start = perf_counter()
+        asyncio.run(analyzer.analyze_group(group))
+        elapsed = perf_counter() - start
+        # Stage timings come from the analyzer's own run metrics
+        stages = dict(analyzer.metrics[analyzer._group_dir(group.title)].stages)
+
+    # The analyzer's own process, and the largest of its sentiment, chart and analysis workers
+    peak_rss_mb = RunMetrics.peak_rss_bytes() / 2 ** 20
+    peak_worker_rss_mb = RunMetrics.peak_rss_bytes(children=True) / 2 ** 20
+
+    return {
+        'messages': count,
+        'seconds': elapsed,
+        'messages_per_sec': count / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb,
+        'peak_worker_rss_mb': peak_worker_rss_mb,
+        'api_requests': analyzer.client.requests,
+        'stages': stages
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analyze_group on synthetic messages")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--reply-ratio', type=float, default=0.3)
+    parser.add_argument('--media-mix', default='photo=0.1,video=0.03,voice=0.02,sticker=0.03,document=0.02',
+                        help="comma separated kind=share pairs (photo, video, voice, sticker, document)")
+    parser.add_argument('--url-density', type=float, default=0.05, help="share of words that are URLs")
+    parser.add_argument('--hashtag-density', type=float, default=0.05)
+    parser.add_argument('--emoji-density', type=float, default=0.1)
+    parser.add_argument('--language', default='en', choices=sorted(WORDS) + ['mixed'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--store', action='store_true', help="sync through the SQLite message store")
+    parser.add_argument('--charts', action='store_true', help="include chart rendering")
+    parser.add_argument('--shards', type=int, default=1, help="concurrent message-id ranges (without --store)")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated seconds per API request")
+    parser.add_argument('--analysis-workers', type=int, default=0,
+                        help="processes analyzing messages while they are fetched (0 analyzes in-process)")
+    parser.add_argument('--json', metavar='PATH', help="also write results as JSON")
+    args = parser.parse_args()
+
+    generator_options = {
+        'reply_ratio': args.reply_ratio,
+        'media_mix': {kind: float(share) for kind, share in
+                      (pair.split('=') for pair in args.media_mix.split(',') if pair)},
+        'url_density': args.url_density,
+        'hashtag_density': args.hashtag_density,
+        'emoji_density': args.emoji_density,
+        'language': args.language,
+        'seed': args.seed
+    }
+
+    # One fresh process per size so peak RSS is not carried over between runs
+    context = multiprocessing.get_context('spawn')
+    results = []
+    console = Console()
+    for count in args.sizes:
+        console.print(f"Benchmarking {count:,} messages...")
+        # Not a multiprocessing.Pool: its daemonic workers cannot start the analyzers' own process pools
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(pool.submit(run_benchmark, count, args.store, args.charts, generator_options,
+                                       args.shards, args.latency, args.analysis_workers).result())
+
+    stages = sorted({stage for result in results for stage in result['stages']})
+    table = Table(title="analyze_group benchmark")
+    for column in ['Messages', 'Seconds', 'Msg/s', 'Peak RSS (MB)', 'Worker Peak RSS (MB)', 'Requests'] + stages:
+        table.add_column(column, justify='right')
+    for result in results:
+        table.add_row(
+            f"{result['messages']:,}", f"{result['seconds']:.2f}", f"{result['messages_per_sec']:,.0f}",
+            f"{result['peak_rss_mb']:.0f}", f"{result['peak_worker_rss_mb']:.0f}", f"{result['api_requests']:,}",
+            *(f"{result['stages'].get(stage, 0.0):.2f}" for stage in stages)
+        )
+    console.print(table)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
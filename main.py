@@ -1,31 +1,2634 @@
 from telethon.sync import TelegramClient
+from telethon import events
 from telethon.tl.functions.messages import GetDialogsRequest
-from telethon.tl.types import InputPeerEmpty, MessageMediaPhoto, MessageMediaDocument
+from telethon.tl.types import InputPeerEmpty, MessageMediaPhoto, MessageMediaDocument, MessageEntityTextUrl
 from telethon.tl.types import UserStatusOnline, UserStatusOffline, UserStatusRecently
-from telethon.utils import get_display_name
-import csv, os, json, re, emoji
-from datetime import datetime, timedelta
-from collections import defaultdict, Counter
+from telethon.tl.types import InputMessagesFilterPhotos, InputMessagesFilterVideo, InputMessagesFilterPhotoVideo
+from telethon.tl.types import InputMessagesFilterDocument, InputMessagesFilterVoice, InputMessagesFilterUrl
+from telethon.tl.types import DocumentAttributeSticker, DocumentAttributeAnimated, DocumentAttributeVideo
+from telethon.tl.types import DocumentAttributeAudio, PhotoSize, PhotoSizeProgressive, PhotoCachedSize, MessageMediaEmpty
+from telethon.utils import get_display_name, get_peer_id
+from telethon.errors import FloodWaitError, ServerError, TimedOutError
+import csv, os, sys, json, re, sqlite3, gzip, argparse, heapq, signal, time, random, pickle, contextvars, math, importlib
+import itertools
+import multiprocessing
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict, Counter, namedtuple, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext
+from bisect import bisect_left, bisect_right
+from statistics import NormalDist
+from zoneinfo import ZoneInfo
 from rich.console import Console
-from rich.progress import track
+from rich.progress import track, Progress, ProgressColumn, TextColumn, BarColumn, TimeElapsedColumn
+from rich.text import Text
 from rich.table import Table
-import pandas as pd
-import networkx as nx
-from textblob import TextBlob
-import matplotlib.pyplot as plt
+import numpy as np
+from array import array
 from urllib.parse import urlparse
+from html import escape
 import asyncio
 import logging
 from pathlib import Path
 
+# Normalized message fields the analyzers read; 'date' is a UTC epoch timestamp,
+# 'entities' holds (kind, text) pairs from Telegram's own entity offsets, None if unknown,
+# and 'media_kind' is the media bucket from media_kind(), None in older stores and dumps
+MessageRecord = namedtuple('MessageRecord', [
+    'id', 'date', 'sender_id', 'text', 'reply_to_msg_id', 'forward_from_id',
+    'reactions', 'media_type', 'mime_type', 'file_size', 'duration', 'entities', 'media_kind'
+], defaults=(None, None))
+
+ENTITY_KINDS = {
+    'MessageEntityUrl': 'url',
+    'MessageEntityTextUrl': 'url',
+    'MessageEntityHashtag': 'hashtag',
+    'MessageEntityMention': 'mention',
+}
+
+
+# Media bucket per Telethon media class; documents are told apart by their attributes and
+# any other class gets its own bucket named after it, so every kind of media is counted
+MEDIA_KINDS = {
+    'MessageMediaPhoto': 'photos',
+    'MessageMediaWebPage': 'webpages',
+    'MessageMediaGeo': 'locations',
+    'MessageMediaGeoLive': 'locations',
+    'MessageMediaVenue': 'locations',
+    'MessageMediaContact': 'contacts',
+    'MessageMediaPoll': 'polls',
+    'MessageMediaDice': 'dice',
+}
+
+
+def _media_kind_by_type(media_type):
+    if media_type in MEDIA_KINDS:
+        return MEDIA_KINDS[media_type]
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', media_type.replace('MessageMedia', '', 1)).lower() or 'other'
+
+
+def _document_kind(document):
+    """Media bucket and duration of a document, from its attributes rather than just the first one"""
+    kind, duration = 'files', None
+    flags = set()
+    for attribute in getattr(document, 'attributes', None) or ():
+        if isinstance(attribute, DocumentAttributeSticker):
+            flags.add('stickers')
+        elif isinstance(attribute, DocumentAttributeAnimated):
+            flags.add('animations')
+        elif isinstance(attribute, DocumentAttributeVideo):
+            flags.add('round_videos' if attribute.round_message else 'videos')
+            duration = attribute.duration
+        elif isinstance(attribute, DocumentAttributeAudio):
+            flags.add('voice_messages' if attribute.voice else 'audio')
+            duration = attribute.duration
+    for candidate in ['stickers', 'animations', 'round_videos', 'videos', 'voice_messages', 'audio']:
+        if candidate in flags:
+            kind = candidate
+            break
+    return kind, duration
+
+
+def _media_size(media):
+    """Bytes of a document or of a photo's largest version, None when unknown"""
+    if isinstance(media, MessageMediaDocument):
+        return getattr(media.document, 'size', None)
+    if isinstance(media, MessageMediaPhoto):
+        sizes = []
+        for size in getattr(media.photo, 'sizes', None) or ():
+            if isinstance(size, PhotoSize):
+                sizes.append(size.size)
+            elif isinstance(size, PhotoSizeProgressive) and size.sizes:
+                sizes.append(max(size.sizes))
+            elif isinstance(size, PhotoCachedSize):
+                sizes.append(len(size.bytes))
+        return max(sizes, default=None)
+    return None
+
+
+def media_kind(record):
+    """Media bucket of a record, e.g. 'photos', 'voice_messages' or 'polls'; None without media
+
+    Records from older stores and dumps lack the attribute-based kind, so
+    documents are then classified by MIME type.
+    """
+    if record.media_kind or not record.media_type or record.media_type == 'MessageMediaEmpty':
+        return record.media_kind
+    if record.media_type != 'MessageMediaDocument':
+        return _media_kind_by_type(record.media_type)
+    mime_type = record.mime_type or ''
+    if mime_type in ('image/webp', 'application/x-tgsticker'):
+        return 'stickers'
+    if mime_type.startswith('video/'):
+        return 'videos'
+    if mime_type == 'audio/ogg':
+        return 'voice_messages'
+    if mime_type.startswith('audio/'):
+        return 'audio'
+    return 'files'
+
+
+def normalize_message(message):
+    """Reduce a Telethon message to a MessageRecord"""
+    media = message.media
+    document = media.document if isinstance(media, MessageMediaDocument) else None
+    kind, duration = None, None
+    if document is not None:
+        kind, duration = _document_kind(document)
+    elif media is not None and not isinstance(media, MessageMediaEmpty):
+        kind = _media_kind_by_type(type(media).__name__)
+
+    forward_from_id = None
+    if message.fwd_from:
+        # Forwards from hidden senders have no peer, count them under 0
+        forward_from_id = get_peer_id(message.fwd_from.from_id) if message.fwd_from.from_id else 0
+
+    reactions = ()
+    if message.reactions:
+        reactions = tuple((_reaction_key(r.reaction), r.count) for r in message.reactions.results)
+
+    # get_entities_text resolves Telegram's UTF-16 offsets into the entity text
+    entities = tuple(
+        (ENTITY_KINDS[type(entity).__name__], entity.url if isinstance(entity, MessageEntityTextUrl) else text)
+        for entity, text in (message.get_entities_text() if message.entities else ())
+        if type(entity).__name__ in ENTITY_KINDS
+    )
+
+    return MessageRecord(
+        id=message.id,
+        date=int(message.date.timestamp()) if message.date else None,
+        sender_id=message.sender_id,
+        text=message.message or None,
+        reply_to_msg_id=getattr(message.reply_to, 'reply_to_msg_id', None),
+        forward_from_id=forward_from_id,
+        reactions=reactions,
+        media_type=type(media).__name__ if media else None,
+        mime_type=getattr(document, 'mime_type', None),
+        file_size=_media_size(media),
+        duration=duration,
+        entities=entities,
+        media_kind=kind
+    )
+
+
+def _reaction_key(reaction):
+    """Turn a Telethon reaction into a hashable, JSON-friendly key"""
+    if isinstance(reaction, str):
+        return reaction
+    if getattr(reaction, 'emoticon', None):
+        return reaction.emoticon
+    if getattr(reaction, 'document_id', None):
+        return f"custom:{reaction.document_id}"
+    return type(reaction).__name__
+
+
+def _to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def parse_time(value):
+    """UTC epoch seconds from an ISO date (UTC unless it has an offset) or a span back from now like 30d, 12h, 2w"""
+    match = re.fullmatch(r'(\d+)([hdw])', value.strip())
+    if match:
+        unit = {'h': 'hours', 'd': 'days', 'w': 'weeks'}[match.group(2)]
+        return int((datetime.now(timezone.utc) - timedelta(**{unit: int(match.group(1))})).timestamp())
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def time_argument(value):
+    """argparse type for --since and --until: checked with parse_time but kept as given, see MessageFilter.parse"""
+    parse_time(value)
+    return value
+
+
+# Selectable message kinds: Telegram's server-side search filter and the matching local test
+MESSAGE_KINDS = {
+    'photos': (InputMessagesFilterPhotos, lambda record: media_kind(record) == 'photos'),
+    'videos': (InputMessagesFilterVideo, lambda record: media_kind(record) == 'videos'),
+    'photo_video': (InputMessagesFilterPhotoVideo, lambda record: media_kind(record) in ('photos', 'videos')),
+    'documents': (InputMessagesFilterDocument, lambda record: record.media_type == 'MessageMediaDocument'),
+    'voice': (InputMessagesFilterVoice, lambda record: media_kind(record) == 'voice_messages'),
+    'urls': (InputMessagesFilterUrl, lambda record: bool(record.text and tokenize_text(record.text, record.entities).urls)),
+}
+
+
+class MessageFilter:
+    """Time window [since, until) in UTC epoch seconds and an optional message kind
+
+    Live scans push the filter down to Telegram: the window becomes a message
+    id range and the kind a server-side search filter. Stored and dumped
+    records are filtered locally with matches(). `arguments` holds since and
+    until as given, so a span like 30d keys the same filter on every run.
+    """
+    def __init__(self, since=None, until=None, kind=None, arguments=None):
+        if kind is not None and kind not in MESSAGE_KINDS:
+            raise ValueError(f"Unknown message kind: {kind}")
+        self.since = since
+        self.until = until
+        self.kind = kind
+        self.arguments = arguments
+
+    @classmethod
+    def parse(cls, since=None, until=None, kind=None):
+        """Filter from --since and --until values (dates or spans back from now) and a kind"""
+        return cls(parse_time(since) if since else None, parse_time(until) if until else None, kind,
+                   arguments=(since, until))
+
+    def __bool__(self):
+        return self.since is not None or self.until is not None or self.kind is not None
+
+    def __repr__(self):
+        return f"MessageFilter(since={self.since}, until={self.until}, kind={self.kind})"
+
+    def key(self):
+        return (*(self.arguments or (self.since, self.until)), self.kind)
+
+    def in_window(self, date):
+        if date is None:
+            return self.since is None and self.until is None
+        return (self.since is None or date >= self.since) and (self.until is None or date < self.until)
+
+    def matches(self, record):
+        return self.in_window(record.date) and (self.kind is None or MESSAGE_KINDS[self.kind][1](record))
+
+    def server_filter(self):
+        """InputMessagesFilter for iter_messages, None without a kind"""
+        return MESSAGE_KINDS[self.kind][0]() if self.kind else None
+
+
+def write_dump(records, path):
+    """Record messages to a JSONL dump, gzip-compressed when the path ends in .gz"""
+    opener = gzip.open if str(path).endswith('.gz') else open
+    count = 0
+    with opener(path, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record._asdict(), ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def read_dump(path):
+    """Yield MessageRecords from a dump written by write_dump"""
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = MessageRecord(**json.loads(line))
+                yield record._replace(
+                    reactions=tuple(map(tuple, record.reactions or ())),
+                    entities=tuple(map(tuple, record.entities)) if record.entities is not None else None
+                )
+
+
+class ColumnTable:
+    """Append-only table of records kept as typed column arrays
+
+    Columns are 'int' (int64, None stored as a sentinel), 'float' (float64,
+    None stored as NaN), 'date' (int64 epoch seconds, ISO strings on export)
+    or 'str' (interned into a per-column string table). Rows are only turned
+    into dicts by iter_records(), i.e. when the analysis is saved.
+    """
+    MISSING = -2 ** 63
+
+    def __init__(self, **columns):
+        self.kinds = columns
+        self.columns = {
+            name: array('d') if kind == 'float' else array('q')
+            for name, kind in columns.items()
+        }
+        self.strings = {name: [] for name, kind in columns.items() if kind == 'str'}
+        self._string_index = {name: {} for name in self.strings}
+
+    def append(self, **values):
+        for name, kind in self.kinds.items():
+            value = values.get(name)
+            if kind == 'str':
+                index = self._string_index[name]
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(self.strings[name])
+                    self.strings[name].append(value)
+                value = code
+            elif value is None:
+                value = float('nan') if kind == 'float' else self.MISSING
+            self.columns[name].append(value)
+
+    def extend(self, **columns):
+        """Append many rows at once from equal-length sequences or NumPy arrays; no None values"""
+        for name, kind in self.kinds.items():
+            values = columns[name]
+            if kind == 'str':
+                index = self._string_index[name]
+                for value in values:
+                    if value not in index:
+                        index[value] = len(self.strings[name])
+                        self.strings[name].append(value)
+                self.columns[name].extend(index[value] for value in values)
+            else:
+                dtype = np.float64 if kind == 'float' else np.int64
+                self.columns[name].frombytes(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    def merge(self, other):
+        """Append every row of a table with the same columns"""
+        for name, kind in self.kinds.items():
+            if kind == 'str':
+                index = self._string_index[name]
+                codes = []
+                for value in other.strings[name]:
+                    if value not in index:
+                        index[value] = len(self.strings[name])
+                        self.strings[name].append(value)
+                    codes.append(index[value])
+                remap = np.array(codes, dtype=np.int64)
+                self.columns[name].frombytes(remap[other.column(name)].tobytes())
+            else:
+                self.columns[name].extend(other.columns[name])
+        return self
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def column(self, name):
+        """Zero-copy NumPy view of a column; 'str' columns return their codes
+
+        The table cannot grow while a view is alive, so drop it before appending.
+        """
+        return np.frombuffer(self.columns[name], dtype=np.float64 if self.kinds[name] == 'float' else np.int64)
+
+    def to_frame(self):
+        """Pandas DataFrame of the table, 'str' columns as categoricals"""
+        import pandas as pd
+        frame = {}
+        for name, kind in self.kinds.items():
+            values = self.column(name)
+            if kind == 'str':
+                frame[name] = pd.Categorical.from_codes(values, categories=pd.Index(self.strings[name], dtype=object))
+            elif kind == 'date':
+                dates = pd.to_datetime(np.where(values == self.MISSING, 0, values), unit='s', utc=True)
+                frame[name] = dates.where(values != self.MISSING)
+            elif kind == 'int':
+                frame[name] = pd.arrays.IntegerArray(values.copy(), values == self.MISSING)
+            else:
+                frame[name] = values
+        return pd.DataFrame(frame)
+
+    def iter_records(self):
+        decoders = []
+        for name, kind in self.kinds.items():
+            if kind == 'str':
+                strings = self.strings[name]
+                decoders.append((name, self.columns[name], strings.__getitem__))
+            elif kind == 'float':
+                decoders.append((name, self.columns[name], lambda value: None if value != value else value))
+            elif kind == 'date':
+                decoders.append((name, self.columns[name],
+                                 lambda value: None if value == self.MISSING else _to_datetime(value).isoformat()))
+            else:
+                decoders.append((name, self.columns[name], lambda value: None if value == self.MISSING else value))
+        for row in range(len(self)):
+            yield {name: decode(column[row]) for name, column, decode in decoders}
+
+    def to_records(self):
+        return list(self.iter_records())
+
+
+def _json_default(obj):
+    """JSON fallback for analysis values, expanding column tables into records"""
+    if isinstance(obj, ColumnTable):
+        return obj.to_records()
+    return str(obj)
+
+
+# Analysis artifact format -> file suffix after '<type>_analysis'
+ARTIFACT_FORMATS = {
+    'json': '.json',
+    'ndjson': '.ndjson',
+    'ndjson.gz': '.ndjson.gz',
+    'ndjson.zst': '.ndjson.zst'
+}
+
+
+def _open_artifact(path, mode):
+    """Open an analysis artifact as text, compressed according to its extension"""
+    path = str(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    if path.endswith('.zst'):
+        import zstandard
+        return zstandard.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def write_analysis(data, path):
+    """Write one analysis result; NDJSON artifacts stream lists and column tables one item per line
+
+    Each line is {"key": ..., "value": ...} for a whole value, or {"key": ..., "item": ...}
+    appending to the list opened by the preceding value line. A list at the top level
+    (member data) uses the key null.
+    """
+    if str(path).endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4, default=_json_default)
+        return
+
+    encode = json.JSONEncoder(ensure_ascii=False, default=_json_default).encode
+    entries = data.items() if isinstance(data, dict) else [(None, data)]
+    with _open_artifact(path, 'w') as f:
+        for key, value in entries:
+            if isinstance(value, ColumnTable):
+                items = value.iter_records()
+            elif isinstance(value, list):
+                items = value
+            else:
+                f.write(encode({'key': key, 'value': value}) + '\n')
+                continue
+            f.write(encode({'key': key, 'value': []}) + '\n')
+            for item in items:
+                f.write(encode({'key': key, 'item': item}) + '\n')
+
+
+def read_analysis(path):
+    """Load an analysis artifact written by write_analysis"""
+    if str(path).endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    data = {}
+    with _open_artifact(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'item' in entry:
+                data[entry['key']].append(entry['item'])
+            else:
+                data[entry['key']] = entry['value']
+    return data[None] if None in data else data
+
+
+def find_analysis(group_dir, analysis_type):
+    """Path of the saved artifact for one analysis type, in any format, or None"""
+    for suffix in ARTIFACT_FORMATS.values():
+        path = f"{group_dir}/{analysis_type}_analysis{suffix}"
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _media_counts(media):
+    """Messages per media kind plus links; analyses saved by older versions hold one list per kind"""
+    if 'kinds' not in media:
+        return {
+            media_type: len(media[media_type])
+            for media_type in ['photos', 'videos', 'files', 'links', 'voice_messages', 'stickers']
+            if media_type in media
+        }
+    counts = {kind: stats['count'] for kind, stats in media['kinds'].items()}
+    counts['links'] = media.get('links', 0)
+    return counts
+
+
+def summarize_analysis(data, top_n=10):
+    """Small aggregate view of the analysis results that the HTML report is built from"""
+    members = data.get('members')
+    messages = data.get('messages')
+    media = data.get('media')
+    network = data.get('network')
+    content = data.get('content')
+    influence = (network or {}).get('influence_scores', {})
+    return {
+        'members': {
+            'total': len(members),
+            'verified': sum(1 for m in members if m.get('is_verified', False)),
+            'bots': sum(1 for m in members if m.get('is_bot', False))
+        } if members else None,
+        'messages': {
+            'activity_hours': messages.get('activity_hours', {}),
+            'activity_days': messages.get('activity_days', {})
+        } if messages else None,
+        'media': {
+            'counts': _media_counts(media),
+            'sizes': {kind: stats['total_size'] for kind, stats in media.get('kinds', {}).items()},
+            'top_domains': Counter(media.get('domains', {})).most_common(top_n)
+        } if media else None,
+        'network': {
+            'interactions': len(network.get('interactions', [])),
+            'communities': len(network.get('communities', [])),
+            'top_influence': sorted(influence.items(), key=lambda item: item[1], reverse=True)[:top_n]
+        } if network else None,
+        'content': {
+            key: Counter(content.get(key, {})).most_common(top_n)
+            for key in ['hashtags', 'mentions', 'languages', 'emoji_usage']
+        } if content else None,
+        # Sampled estimates are already small
+        'sample': data.get('sample')
+    }
+
+
+class MessageStore:
+    """SQLite store of normalized messages for one group, synced incrementally by message id"""
+    # One column per MessageRecord field, in field order
+    COLUMNS = [
+        ('id', 'INTEGER PRIMARY KEY'),
+        ('date', 'INTEGER'),
+        ('sender_id', 'INTEGER'),
+        ('text', 'TEXT'),
+        ('reply_to_msg_id', 'INTEGER'),
+        ('forward_from_id', 'INTEGER'),
+        ('reactions', 'TEXT'),
+        ('media_type', 'TEXT'),
+        ('mime_type', 'TEXT'),
+        ('file_size', 'INTEGER'),
+        ('duration', 'REAL'),
+        ('entities', 'TEXT'),
+        ('media_kind', 'TEXT'),
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # Readers do not block the writer in WAL mode, so a live rebuild can read on a worker thread
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS messages ({', '.join(f'{name} {kind}' for name, kind in self.COLUMNS)})"
+        )
+        # Stores created by older versions lack the newer columns
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(messages)")}
+        for name, kind in self.COLUMNS:
+            if name not in existing:
+                self.connection.execute(f"ALTER TABLE messages ADD COLUMN {name} {kind}")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS messages_date ON messages (date)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.column_names = ', '.join(name for name, _ in self.COLUMNS)
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        self.connection.commit()
+
+    def max_id(self):
+        """Highest stored message id, 0 for an empty store"""
+        return self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def add(self, records):
+        """Insert or replace a batch of records and commit them"""
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO messages ({self.column_names}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+            [record._replace(
+                reactions=json.dumps(record.reactions, ensure_ascii=False) if record.reactions else None,
+                entities=json.dumps(record.entities, ensure_ascii=False) if record.entities is not None else None
+            ) for record in records]
+        )
+        self.connection.commit()
+
+    def delete(self, ids):
+        """Remove messages by id and return how many were stored"""
+        cursor = self.connection.executemany("DELETE FROM messages WHERE id = ?", [(message_id,) for message_id in ids])
+        self.connection.commit()
+        return cursor.rowcount
+
+    def iter_records(self, batch_size=10000, since=None, until=None, after_id=None, through_id=None):
+        """Yield stored records in ascending id order
+
+        Optionally only those dated in [since, until) and with ids in (after_id, through_id].
+        """
+        conditions, parameters = [], []
+        if after_id is not None:
+            conditions.append("id > ?")
+            parameters.append(after_id)
+        if through_id is not None:
+            conditions.append("id <= ?")
+            parameters.append(through_id)
+        if since is not None:
+            conditions.append("date >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("date < ?")
+            parameters.append(until)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.connection.execute(f"SELECT {self.column_names} FROM messages{where} ORDER BY id", parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                record = MessageRecord(*row)
+                yield record._replace(
+                    reactions=tuple(map(tuple, json.loads(record.reactions))) if record.reactions else (),
+                    entities=tuple(map(tuple, json.loads(record.entities))) if record.entities is not None else None
+                )
+
+    def close(self):
+        self.connection.close()
+
+
+TextTokens = namedtuple('TextTokens', ['urls', 'hashtags', 'mentions', 'keywords', 'emojis'])
+
+
+class TextTokenizer:
+    """Extracts URLs, hashtags, mentions, keywords and emoji from a message text
+
+    A single precompiled pattern finds URLs, hashtags, mentions and emoji runs
+    in one pass; its leading lookahead lets the regex engine skip straight to
+    candidate characters. Emoji runs are split into complete emoji, including
+    ZWJ sequences, flags, keycaps and skin tones, by longest match against a
+    trie of emoji.EMOJI_DATA. When Telegram's entities are known they are used
+    for URLs, hashtags and mentions, and pure ASCII texts skip the scan.
+    """
+    EMOJI_START = r'\u00a9\u00ae\u203c-\u3299\U0001F000-\U0001FAFF\U000E0020-\U000E007F'
+    EMOJI_JOINERS = r'\u200d\ufe0f\u20e3'
+
+    def __init__(self):
+        start, joiners = self.EMOJI_START, self.EMOJI_JOINERS
+        self.pattern = re.compile(
+            rf"(?=[h#@*0-9{start}])(?:"
+            rf"(https?://[^\s<>\"']+)|(#\w+)|(@\w+)|"
+            rf"([#*0-9]\ufe0f?\u20e3|[{start}][{start}{joiners}]*))"
+        )
+        import emoji
+        self.emoji_index = emoji.EMOJI_DATA
+        self.emoji_trie = {}
+        for emoji_text in self.emoji_index:
+            node = self.emoji_trie
+            for char in emoji_text:
+                node = node.setdefault(char, {})
+            node[''] = True
+
+    def tokenize(self, text, entities=None):
+        urls, hashtags, mentions, emojis = [], [], [], []
+        if entities is not None:
+            for kind, value in entities:
+                {'url': urls, 'hashtag': hashtags, 'mention': mentions}[kind].append(value)
+
+        if entities is None or not text.isascii():
+            for url, hashtag, mention, emoji_run in self.pattern.findall(text):
+                if emoji_run:
+                    if emoji_run in self.emoji_index:
+                        emojis.append(emoji_run)
+                    else:
+                        emojis.extend(self._split_emoji(emoji_run))
+                elif entities is None:
+                    if url:
+                        urls.append(url)
+                    elif hashtag:
+                        hashtags.append(hashtag)
+                    else:
+                        mentions.append(mention)
+
+        return TextTokens(urls, hashtags, mentions, text.lower().split(), emojis)
+
+    def _split_emoji(self, run):
+        found = []
+        position = 0
+        while position < len(run):
+            node = self.emoji_trie
+            end = None
+            cursor = position
+            while cursor < len(run) and run[cursor] in node:
+                node = node[run[cursor]]
+                cursor += 1
+                if '' in node:
+                    end = cursor
+            if end:
+                found.append(run[position:end])
+                position = end
+            else:
+                position += 1
+        return found
+
+
+@lru_cache(maxsize=None)
+def _text_tokenizer():
+    """Shared TextTokenizer, built on first use"""
+    return TextTokenizer()
+
+
+@lru_cache(maxsize=16)
+def tokenize_text(text, entities=None):
+    """Tokens of a message text, cached so every analyzer reuses one tokenization per message"""
+    return _text_tokenizer().tokenize(text, entities)
+
+
+class MessageConsumer:
+    """Base class for analyzers fed from the single message scan"""
+    name = None
+
+    def __init__(self):
+        self.data = {}
+
+    def process(self, message):
+        """Consume one MessageRecord from the scan"""
+        raise NotImplementedError
+
+    def finalize(self):
+        """Return the finished analysis once the scan is complete"""
+        return self.data
+
+    def merge(self, other):
+        """Fold in the partial state of another instance fed a different part of the history"""
+        raise NotImplementedError
+
+    def start(self):
+        """Called before a fresh pass over the history, not when a checkpointed scan resumes"""
+
+    async def drain(self, wait_all=False):
+        """Await work handed off the event loop; wait_all waits for all of it, as before merge or finalize"""
+
+    def close(self):
+        """Release what the analyzer holds when it is discarded without being finalized"""
+
+
+class ActivityTimeline:
+    """Collects message timestamps and computes all activity time series in one vectorized step
+
+    buckets maps output labels to pandas frequencies, rolling_windows are
+    window lengths in days over the daily series, and per-user series are
+    kept for the top_users most active senders at the user_bucket resolution.
+    """
+    WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+    def __init__(self, timezone='UTC', buckets=None, rolling_windows=(7, 30), top_users=20, user_bucket='weekly'):
+        self.timezone = timezone
+        self.buckets = buckets or {'daily': 'D', 'weekly': 'W'}
+        self.rolling_windows = rolling_windows
+        self.top_users = top_users
+        self.user_bucket = user_bucket
+        self.timestamps = array('q')
+        self.senders = array('q')
+
+    def add(self, timestamp, sender_id):
+        self.timestamps.append(timestamp)
+        self.senders.append(sender_id or 0)
+
+    def merge(self, other):
+        self.timestamps.extend(other.timestamps)
+        self.senders.extend(other.senders)
+
+    def compute(self):
+        import pandas as pd
+        timestamps = np.frombuffer(self.timestamps, dtype=np.int64)
+        senders = np.frombuffer(self.senders, dtype=np.int64)
+        dates = pd.to_datetime(timestamps, unit='s', utc=True).tz_convert(self.timezone)
+        hours = dates.hour.to_numpy()
+        weekdays = dates.dayofweek.to_numpy()
+
+        heatmap = np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
+        result = {
+            'timezone': str(self.timezone),
+            'activity_hours': {hour: int(count) for hour, count in enumerate(heatmap.sum(axis=0))},
+            'activity_days': {day: int(count) for day, count in zip(self.WEEKDAYS, heatmap.sum(axis=1))},
+            'activity_heatmap': {day: row.tolist() for day, row in zip(self.WEEKDAYS, heatmap)},
+            'time_series': {},
+            'rolling_activity': {},
+            'user_time_series': {}
+        }
+        if not len(timestamps):
+            return result
+
+        frame = pd.DataFrame({'sender_id': senders}, index=dates)
+        for label, frequency in self.buckets.items():
+            result['time_series'][label] = self._series_to_dict(frame.resample(frequency).size())
+
+        daily = frame.resample('D').size()
+        for window in self.rolling_windows:
+            rolling = daily.rolling(window, min_periods=1).mean().round(3)
+            result['rolling_activity'][f"{window}d"] = self._series_to_dict(rolling)
+
+        if self.top_users and self.user_bucket in self.buckets:
+            ids, counts = np.unique(senders, return_counts=True)
+            top = ids[np.lexsort((ids, -counts))][:self.top_users]
+            user_frame = frame[np.isin(senders, top)]
+            grouped = user_frame.groupby(['sender_id', pd.Grouper(freq=self.buckets[self.user_bucket])]).size()
+            for sender_id, series in grouped.groupby(level=0):
+                result['user_time_series'][int(sender_id)] = self._series_to_dict(series.droplevel(0))
+
+        return result
+
+    @staticmethod
+    def _series_to_dict(series):
+        return dict(zip(series.index.strftime('%Y-%m-%d'), series.tolist()))
+
+
+class MessageAnalyzer(MessageConsumer):
+    """Analyze message patterns and activity"""
+    name = 'messages'
+
+    def __init__(self, **timeline_options):
+        self.timeline = ActivityTimeline(**timeline_options)
+        self.data = {
+            'user_activity': defaultdict(int),
+            'reply_patterns': defaultdict(list),
+            'forward_patterns': defaultdict(int),
+            'reactions': defaultdict(Counter),
+            'message_types': defaultdict(int)
+        }
+
+    def process(self, message):
+        # Time analysis, computed in bulk by the timeline at the end of the scan
+        if message.date:
+            self.timeline.add(message.date, message.sender_id)
+
+        # User activity
+        if message.sender_id:
+            self.data['user_activity'][message.sender_id] += 1
+
+        # Reply patterns
+        if message.reply_to_msg_id:
+            self.data['reply_patterns'][message.sender_id].append(message.reply_to_msg_id)
+
+        # Forwards
+        if message.forward_from_id is not None:
+            self.data['forward_patterns'][message.forward_from_id] += 1
+
+        # Reactions
+        for reaction, _ in message.reactions:
+            self.data['reactions'][message.sender_id][reaction] += 1
+
+        # Message types
+        self.data['message_types'][message.media_type or 'text'] += 1
+
+    def finalize(self):
+        self.data.update(self.timeline.compute())
+        return self.data
+
+    def merge(self, other):
+        self.timeline.merge(other.timeline)
+        for key in ['user_activity', 'forward_patterns', 'message_types']:
+            for item, count in other.data[key].items():
+                self.data[key][item] += count
+        for sender_id, replies in other.data['reply_patterns'].items():
+            self.data['reply_patterns'][sender_id].extend(replies)
+        for sender_id, reactions in other.data['reactions'].items():
+            self.data['reactions'][sender_id].update(reactions)
+        return self
+
+
+class MediaStats:
+    """Constant-memory statistics of one media bucket: count, sizes, durations and top senders"""
+    # Upper bounds in seconds of the duration histogram buckets; the last one is open
+    DURATION_BUCKETS = [5, 15, 30, 60, 180, 600, 1800, 3600]
+
+    def __init__(self, sketch_size=1000):
+        self.count = 0
+        self.total_size = 0
+        self.sizes = QuantileSketch()
+        self.total_duration = 0.0
+        self.durations = [0] * (len(self.DURATION_BUCKETS) + 1)
+        self.senders = SpaceSaving(sketch_size)
+
+    def add(self, record):
+        self.count += 1
+        if record.file_size is not None:
+            self.total_size += record.file_size
+            self.sizes.add(record.file_size)
+        if record.duration is not None:
+            self.total_duration += record.duration
+            self.durations[bisect_left(self.DURATION_BUCKETS, record.duration)] += 1
+        if record.sender_id:
+            self.senders.add(record.sender_id)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_size += other.total_size
+        self.sizes.merge(other.sizes)
+        self.total_duration += other.total_duration
+        self.durations = [own + theirs for own, theirs in zip(self.durations, other.durations)]
+        self.senders.merge(other.senders)
+
+    def to_dict(self, top_n=100):
+        labels = [f"<={bound}s" for bound in self.DURATION_BUCKETS] + [f">{self.DURATION_BUCKETS[-1]}s"]
+        result = {
+            'count': self.count,
+            'total_size': self.total_size,
+            'size': self.sizes.to_dict(),
+            # Ties broken by sender so sharded and sequential scans list the same senders
+            'top_senders': dict(sorted(self.senders.most_common(), key=lambda item: (-item[1], item[0]))[:top_n])
+        }
+        if any(self.durations):
+            result['total_duration'] = self.total_duration
+            result['durations'] = dict(zip(labels, self.durations))
+        return result
+
+
+class MediaAnalyzer(MessageConsumer):
+    """Analyze media content in constant memory
+
+    Every media message is counted in its media_kind() bucket with its total
+    and quantile-sketched file size, a duration histogram and its top senders;
+    MIME types get a count and total size, and links their top domains. Senders
+    and domains are Space-Saving sketches of sketch_size counters (1000 by
+    default). With a `spill` path, one NDJSON line per media message and link
+    is appended there for offline drill-down.
+    """
+    name = 'media'
+
+    def __init__(self, sketch_size=None, top_n=100, spill=None):
+        self.sketch_size = sketch_size or 1000
+        self.top_n = top_n
+        self.spill = spill
+        self.spill_file = None
+        self.kinds = {}
+        self.data = {
+            'mime_types': {},
+            'links': 0,
+            'domains': SpaceSaving(self.sketch_size)
+        }
+
+    def start(self):
+        if self.spill and os.path.exists(self.spill):
+            os.remove(self.spill)
+
+    def process(self, message):
+        kind = media_kind(message)
+        if kind:
+            stats = self.kinds.get(kind)
+            if stats is None:
+                stats = self.kinds[kind] = MediaStats(self.sketch_size)
+            stats.add(message)
+            if message.mime_type:
+                mime = self.data['mime_types'].setdefault(message.mime_type, {'count': 0, 'total_size': 0})
+                mime['count'] += 1
+                mime['total_size'] += message.file_size or 0
+            if self.spill:
+                self._spill(id=message.id, date=message.date, sender_id=message.sender_id, kind=kind,
+                            mime_type=message.mime_type, file_size=message.file_size, duration=message.duration)
+
+        # Extract links
+        if message.text:
+            for url in tokenize_text(message.text, message.entities).urls:
+                # URL entities may omit the scheme
+                domain = urlparse(url if '://' in url else f"http://{url}").netloc
+                self.data['domains'].add(domain)
+                self.data['links'] += 1
+                if self.spill:
+                    self._spill(id=message.id, date=message.date, sender_id=message.sender_id, kind='link',
+                                url=url, domain=domain)
+
+    def _spill(self, **detail):
+        if self.spill_file is None:
+            # Line buffered, so nothing is left behind when another pass truncates the file
+            self.spill_file = open(self.spill, 'a', encoding='utf-8', buffering=1)
+        self.spill_file.write(json.dumps(detail, ensure_ascii=False) + '\n')
+
+    def finalize(self):
+        self.close()
+        self.data['kinds'] = {
+            kind: stats.to_dict(self.top_n)
+            for kind, stats in sorted(self.kinds.items(), key=lambda item: item[1].count, reverse=True)
+        }
+        _finalize_heavy_hitters(self.data, ['domains'], self.top_n)
+        return self.data
+
+    def merge(self, other):
+        for kind, stats in other.kinds.items():
+            if kind in self.kinds:
+                self.kinds[kind].merge(stats)
+            else:
+                self.kinds[kind] = stats
+        for mime_type, stats in other.data['mime_types'].items():
+            mime = self.data['mime_types'].setdefault(mime_type, {'count': 0, 'total_size': 0})
+            mime['count'] += stats['count']
+            mime['total_size'] += stats['total_size']
+        self.data['links'] += other.data['links']
+        _merge_heavy_hitters(self.data, other.data, ['domains'])
+        other.close()
+        return self
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def __getstate__(self):
+        # Checkpoints and snapshots keep the spill path; the copy reopens the file if it writes
+        state = self.__dict__.copy()
+        state['spill_file'] = None
+        return state
+
+
+def _pagerank(matrix, alpha=0.85, tol=1e-6, max_iter=100):
+    """PageRank by power iteration on a weighted sparse adjacency matrix (row = source)"""
+    import scipy.sparse as sp
+    n = matrix.shape[0]
+    out_weight = np.asarray(matrix.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    transition = sp.diags(np.divide(1.0, out_weight, out=np.zeros(n), where=~dangling)) @ matrix
+    transition_t = transition.T.tocsr()
+    ranks = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        previous = ranks
+        ranks = alpha * (transition_t @ ranks + ranks[dangling].sum() / n) + (1 - alpha) / n
+        if np.abs(ranks - previous).sum() < n * tol:
+            break
+    return ranks / ranks.sum()
+
+
+def _label_propagation(matrix, max_iter=20):
+    """Community labels by weighted label propagation on a symmetric sparse matrix
+
+    Every round each node takes the label with the largest total edge weight
+    among its neighbours, computed for all nodes at once as a sparse
+    node x label product. A node keeps its label on ties, which also keeps
+    the synchronous updates from oscillating.
+    """
+    import scipy.sparse as sp
+    n = matrix.shape[0]
+    labels = np.arange(n)
+    coo = matrix.tocoo()
+    for _ in range(max_iter):
+        scores = sp.csr_matrix((coo.data, (coo.row, labels[coo.col])), shape=(n, n))
+        scores.sum_duplicates()
+        best_score = scores.max(axis=1).toarray().ravel()
+        entry_rows = np.repeat(np.arange(n), np.diff(scores.indptr))
+        is_best = scores.data >= best_score[entry_rows]
+        best = labels.copy()
+        best[entry_rows[is_best][::-1]] = scores.indices[is_best][::-1]
+        current_score = np.bincount(
+            coo.row, weights=coo.data * (labels[coo.col] == labels[coo.row]), minlength=n
+        )
+        new_labels = np.where((current_score >= best_score) | (best_score == 0), labels, best)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels
+
+
+class NetworkAnalyzer(MessageConsumer):
+    """Analyze user interaction network
+
+    Every message's id, sender and date go into array-backed columns, so at
+    the end of the scan each reply resolves to the user who was replied to.
+    Metrics are computed on a sparse user x user adjacency matrix.
+    """
+    name = 'network'
+
+    def __init__(self, max_iter=100):
+        self.max_iter = max_iter
+        self.message_ids = array('q')
+        self.message_senders = array('q')
+        self.message_dates = array('q')
+        self.reply_senders = array('q')
+        self.reply_parents = array('q')
+        self.reply_dates = array('q')
+        self.data = {
+            'interactions': ColumnTable(from_user='int', to_user='int', type='str', date='date', latency='float'),
+            'edges': ColumnTable(from_user='int', to_user='int', weight='int', mean_latency='float'),
+            'unresolved_replies': 0,
+            'user_centrality': {},
+            'communities': [],
+            'influence_scores': {}
+        }
+
+    def process(self, message):
+        if message.sender_id is None or message.date is None:
+            return
+        self.message_ids.append(message.id)
+        self.message_senders.append(message.sender_id)
+        self.message_dates.append(message.date)
+        if message.reply_to_msg_id:
+            self.reply_senders.append(message.sender_id)
+            self.reply_parents.append(message.reply_to_msg_id)
+            self.reply_dates.append(message.date)
+
+    def finalize(self):
+        try:
+            self._resolve_replies()
+            self._calculate_metrics()
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Error calculating network metrics: {str(e)}")
+        return self.data
+
+    def merge(self, other):
+        # Replies are resolved at finalize, so parents seen by another shard still match
+        for name in ['message_ids', 'message_senders', 'message_dates',
+                     'reply_senders', 'reply_parents', 'reply_dates']:
+            getattr(self, name).extend(getattr(other, name))
+        return self
+
+    def _resolve_replies(self):
+        import scipy.sparse as sp
+        ids = np.frombuffer(self.message_ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        senders = np.frombuffer(self.message_senders, dtype=np.int64)[order]
+        dates = np.frombuffer(self.message_dates, dtype=np.int64)[order]
+
+        reply_senders = np.frombuffer(self.reply_senders, dtype=np.int64)
+        parents = np.frombuffer(self.reply_parents, dtype=np.int64)
+        reply_dates = np.frombuffer(self.reply_dates, dtype=np.int64)
+
+        # Replies to messages outside the scanned history cannot be attributed
+        position = np.minimum(np.searchsorted(ids, parents), max(len(ids) - 1, 0))
+        resolved = (ids[position] == parents) if len(ids) else np.zeros(len(parents), dtype=bool)
+        self.data['unresolved_replies'] = int((~resolved).sum())
+
+        from_users = reply_senders[resolved]
+        to_users = senders[position[resolved]]
+        latency = (reply_dates[resolved] - dates[position[resolved]]).astype(np.float64)
+        reply_dates = reply_dates[resolved]
+        self.data['interactions'].extend(
+            from_user=from_users, to_user=to_users, type=['reply'] * len(from_users),
+            date=reply_dates, latency=latency
+        )
+
+        # Self-replies continue a thread rather than connect two users
+        between_users = from_users != to_users
+        self.users, user_index = np.unique(
+            np.concatenate([from_users[between_users], to_users[between_users]]), return_inverse=True
+        )
+        edge_from, edge_to = np.split(user_index, 2)
+        pairs, pair_index, weights = np.unique(
+            np.stack([edge_from, edge_to], axis=1), axis=0, return_inverse=True, return_counts=True
+        ) if len(edge_from) else (np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        mean_latency = np.bincount(pair_index.ravel(), weights=latency[between_users], minlength=len(pairs)) / np.maximum(weights, 1)
+        self.data['edges'].extend(
+            from_user=self.users[pairs[:, 0]], to_user=self.users[pairs[:, 1]], weight=weights, mean_latency=mean_latency
+        )
+        self.adjacency = sp.csr_matrix(
+            (weights.astype(np.float64), (pairs[:, 0], pairs[:, 1])), shape=(len(self.users), len(self.users))
+        )
+
+    def _calculate_metrics(self):
+        users = self.users.tolist()
+        n = len(users)
+        if not n:
+            return
+
+        undirected = self.adjacency + self.adjacency.T
+        degree = np.diff((undirected > 0).astype(np.int8).tocsr().indptr)
+        centrality = degree / (n - 1) if n > 1 else np.ones(n)
+        self.data['user_centrality'] = dict(zip(users, centrality.tolist()))
+
+        ranks = _pagerank(self.adjacency, max_iter=self.max_iter)
+        self.data['influence_scores'] = dict(zip(users, ranks.tolist()))
+
+        labels = _label_propagation(undirected)
+        communities = defaultdict(list)
+        for user, label in zip(users, labels.tolist()):
+            communities[label].append(user)
+        self.data['communities'] = sorted(communities.values(), key=len, reverse=True)
+
+
+class RunningStats:
+    """Count, mean and variance of a stream of values (Welford), mergeable across partials"""
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'variance': self.m2 / self.count if self.count else 0.0
+        }
+
+
+class QuantileSketch:
+    """Quantiles of positive values within a relative error, in log-spaced buckets (DDSketch)
+
+    Value v falls in bucket ceil(log(v) / log(gamma)) with gamma = (1 + a) / (1 - a),
+    so every reported quantile is within a relative error a of a true value, and
+    memory grows only with the log of the value range (about 1,100 buckets from
+    one byte to 4 GB at 1%). Sketches with the same accuracy merge exactly.
+    """
+    __slots__ = ('accuracy', 'gamma', 'buckets', 'zeros', 'count', 'minimum', 'maximum')
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        self.count += 1
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value, self.gamma))] += 1
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Bucket midpoint, clamped to the values actually seen
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+    def to_dict(self, quantiles=(0.5, 0.9, 0.99)):
+        result = {f"p{round(q * 100)}": self.quantile(q) for q in quantiles}
+        result.update(min=self.minimum, max=self.maximum)
+        return result
+
+
+def _score_sentiment_batch(texts):
+    """Polarity for each text, None where TextBlob fails; runs in a worker process"""
+    from textblob import TextBlob
+    scores = []
+    for text in texts:
+        try:
+            scores.append(TextBlob(text).sentiment.polarity)
+        except Exception:
+            scores.append(None)
+    return scores
+
+
+# Worker count -> [pool, engines using it]; engines finalized on worker threads share it too
+_sentiment_pools = {}
+_sentiment_pools_lock = threading.Lock()
+
+
+def _acquire_sentiment_pool(workers):
+    with _sentiment_pools_lock:
+        entry = _sentiment_pools.get(workers)
+        if entry is None:
+            entry = _sentiment_pools[workers] = [ProcessPoolExecutor(max_workers=workers), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_sentiment_pool(workers):
+    with _sentiment_pools_lock:
+        entry = _sentiment_pools[workers]
+        entry[1] -= 1
+        if entry[1]:
+            return
+        del _sentiment_pools[workers]
+    entry[0].shutdown()
+
+
+class SentimentEngine:
+    """Batched sentiment scoring on a process pool with a bounded LRU cache of scored texts
+
+    Texts are deduplicated against the cache and within each batch, batches
+    are scored off the calling thread, and scores are folded into per-sender
+    RunningStats as batches complete. workers=0 scores batches in-process.
+    Engines with the same worker count share one pool while any of them is
+    scoring, so concurrent scans (shards, batch runs) do not each start one.
+    A text already in a batch in flight is not sent again; its sender is
+    scored when that batch completes. Scans on the event loop await drain()
+    to bound the batches in flight; on worker threads submit() waits instead.
+    """
+
+    def __init__(self, workers=None, batch_size=256, cache_size=50000):
+        self.workers = max(1, (os.cpu_count() or 2) - 1) if workers is None else workers
+        if _analysis_worker:
+            self.workers = 0
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.stats = defaultdict(RunningStats)
+        self.executor = None
+        self.batch = {}
+        # Future -> batch in flight, text in flight -> its senders, future -> asyncio waiter
+        self.pending = {}
+        self.inflight = {}
+        self.waiters = {}
+        self.drained = False
+
+    def __getstate__(self):
+        # Checkpoints and snapshots pickle the engine without waiting on the pool:
+        # texts of batches still in flight are batched again in the copy. Engines
+        # scoring in-process, as on analysis workers, score their tail first so
+        # the partial needs no scoring where it is merged
+        if not self.workers:
+            self._flush()
+        self._collect()
+        state = self.__dict__.copy()
+        batch = dict(self.batch)
+        for pending in self.pending.values():
+            batch.update(pending)
+        state.update(executor=None, batch=batch, pending={}, inflight={}, waiters={})
+        return state
+
+    def submit(self, sender_id, text):
+        score = self.cache.get(text)
+        if score is not None:
+            self.cache.move_to_end(text)
+            self.stats[sender_id].add(score)
+            return
+        senders = self.inflight.get(text)
+        if senders is not None:
+            senders.append(sender_id)
+            return
+        self.batch.setdefault(text, []).append(sender_id)
+        if len(self.batch) >= self.batch_size:
+            self._flush()
+
+    def results(self):
+        """Wait for outstanding batches and return per-sender sentiment statistics"""
+        self._flush()
+        self._collect(wait_all=True)
+        self._release()
+        return {sender_id: stats.to_dict() for sender_id, stats in self.stats.items()}
+
+    def merge(self, other):
+        """Fold another engine's per-sender statistics into this one"""
+        other._flush()
+        other._collect(wait_all=True)
+        other._release()
+        for sender_id, stats in other.stats.items():
+            self.stats[sender_id].merge(stats)
+        return self
+
+    async def drain(self, wait_all=False):
+        """Await completed batches without blocking the event loop
+
+        Returns at once unless more than workers * 2 batches are in flight;
+        wait_all also scores what is still batched and waits for all of it.
+        Once drained this way, the engine leaves bounding the batches in
+        flight to its caller instead of waiting on the pool in submit().
+        """
+        self.drained = True
+        if wait_all:
+            self._flush()
+        while self.pending and (wait_all or len(self.pending) > self.workers * 2):
+            for future in self.pending:
+                if future not in self.waiters:
+                    self.waiters[future] = asyncio.wrap_future(future)
+            done, _ = await asyncio.wait(list(self.waiters.values()),
+                                         return_when=ALL_COMPLETED if wait_all else FIRST_COMPLETED)
+            for waiter in done:
+                if not waiter.cancelled():
+                    waiter.exception()
+            self._collect()
+
+    def close(self):
+        """Drop unscored texts and give back the pool"""
+        self.batch = {}
+        self.pending = {}
+        self.inflight = {}
+        self.waiters = {}
+        self._release()
+
+    def _release(self):
+        if self.executor:
+            self.executor = None
+            _release_sentiment_pool(self.workers)
+
+    def _flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, {}
+        texts = list(batch)
+        if not self.workers:
+            self._apply(batch, texts, _score_sentiment_batch(texts))
+            return
+        if self.executor is None:
+            self.executor = _acquire_sentiment_pool(self.workers)
+        self.pending[self.executor.submit(_score_sentiment_batch, texts)] = batch
+        self.inflight.update(batch)
+        # Bound the number of in-flight batches so memory stays flat on long scans
+        self._collect(wait_all=not self.drained and len(self.pending) > self.workers * 2)
+
+    def _collect(self, wait_all=False):
+        if not self.pending:
+            return
+        done, _ = wait(self.pending, timeout=None if wait_all else 0,
+                       return_when=ALL_COMPLETED if wait_all else FIRST_COMPLETED)
+        for future in done:
+            batch = self.pending.pop(future)
+            self.waiters.pop(future, None)
+            try:
+                self._apply(batch, list(batch), future.result())
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Error scoring sentiment batch: {str(e)}")
+            for text in batch:
+                del self.inflight[text]
+
+    def _apply(self, batch, texts, scores):
+        for text, score in zip(texts, scores):
+            if score is None:
+                continue
+            for sender_id in batch[text]:
+                self.stats[sender_id].add(score)
+            self.cache[text] = score
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+
+# Seed vocabularies for the offline language identifier, most frequent words first
+LANGUAGE_SEED_WORDS = {
+    'en': "the of and to in is you that it he was for on are as with his they at be this have from or one had "
+          "by but not what all were we when your can said there an each which she do how their if will up other "
+          "about out many then them these so some her would make like him into time has look two more go see no "
+          "way could people my than first been who its now find day did get come made may thanks please good "
+          "what's today just know think really right here why where yes would should could there their about "
+          "going want need time year work know back after also only new because any give most us even our over "
+          "such much before must well those through down last while again never same another something nothing "
+          "anyone everyone tomorrow ticket meeting question answer hello hi world great bad awful",
+    'de': "der die und in den von zu das mit sich des auf für ist im dem nicht ein eine als auch es an werden "
+          "aus er hat dass sie nach wird bei einer um am sind noch wie einem über einen so zum war haben nur "
+          "oder aber vor zur bis mehr durch man sein wurde sei ich du wir ihr mich dich heute gut danke bitte "
+          "ja nein was wer wo warum schon jetzt hier gibt kann muss sehr viel wir sollten morgen treffen jemand "
+          "weiß wo kaufen vielen dank für schnelle antwort glaube dass uns können wollen müssen immer wieder "
+          "etwas nichts alle diese dieser zeit jahr neue gerade einfach wirklich gestern leider",
+    'fr': "le de un être et à il avoir ne je son que se qui ce dans en du elle au pour pas sur plus par avec "
+          "tout faire autre on mais nous comme ou si leur dire bien où sans deux même aussi les des est une "
+          "sont très merci bonjour oui non pourquoi vous tu cette c'est était aujourd'hui beaucoup peut fait "
+          "chez je pense que nous devrions rencontrer demain quelqu'un sait acheter billets beaucoup réponse "
+          "rapide pouvez voulez toujours encore rien tous cette temps année nouveau vraiment hier "
+          "malheureusement quelque chose",
+    'es': "el la de que y a en un ser se no haber por con su para como estar tener le lo todo pero más hacer o "
+          "poder decir este ir otro ese si me ya ver porque dar cuando muy sin vez mucho saber qué sobre mi "
+          "mismo yo también hasta año dos querer entre así desde grande eso ni nos tiempo ella sí día uno bien "
+          "poco entonces cosa gracias hola los las del es está son hoy aquí creo que deberíamos reunirnos "
+          "mañana alguien sabe dónde comprar entradas muchas gracias respuesta rápida podemos queremos siempre "
+          "nada todos esta año nuevo realmente ayer desafortunadamente algo nosotros ustedes",
+    'it': "di e il la che a per un in è non sono con si da le del una mi ma ho lo ha come io questo anche più "
+          "al della gli se cosa mio ti ci sei quando molto dei alla bene tutto nel sì tu perché fare essere "
+          "grazie ciao buongiorno ancora fatto stato hai era questa delle già oggi qui penso che dovremmo "
+          "incontrarci domani qualcuno sa dove comprare biglietti grazie mille risposta veloce possiamo "
+          "vogliamo sempre niente tutti questa tempo anno nuovo davvero ieri purtroppo qualcosa noi voi",
+    'pt': "de a o que e do da em um para é com não uma os no se na por mais as dos como mas foi ao ele das tem "
+          "à seu sua ou ser quando muito há nos já está eu também só pelo pela até isso ela entre era depois "
+          "sem mesmo aos ter seus quem nas me esse eles estão você tinha foram essa num nem obrigado olá sim "
+          "então hoje aqui acho que devemos nos encontrar amanhã alguém sabe onde comprar ingressos muito "
+          "obrigado resposta rápida podemos queremos sempre nada todos esta tempo ano novo realmente ontem "
+          "infelizmente alguma coisa nós vocês não então ação informação",
+    'nl': "de het een en van ik te dat die in is niet je zijn op aan met voor er maar om hem dan zou of wat "
+          "mijn men dit zo door over ze zich bij ook tot naar kan al wel nog heeft moet worden hebben was wij "
+          "jij dank goed hoe waarom geen veel wordt vandaag hier ik denk dat we morgen moeten afspreken weet "
+          "iemand waar kaartjes kopen heel erg bedankt snelle antwoord kunnen willen altijd niets alle deze "
+          "tijd jaar nieuw echt gisteren helaas iets",
+    'sv': "och i att det som en på är av för med till den har de inte om ett han men var jag sig från vi så kan "
+          "man när år säger hon under också efter eller nu sin där vid mot ska skulle kommer ut får finns vara "
+          "hade alla andra mycket än här då sedan över bara tack hej idag jag tycker att vi borde träffas i "
+          "morgon vet någon var man köpa biljetter tack så mycket snabba svaret kan vill alltid ingenting alla "
+          "denna tid år ny verkligen igår tyvärr något",
+    'pl': "nie i w się na z do jest to że a o jak ale po co tak za od tylko już jego go czy jej może być mnie "
+          "mi są ja ty on ona my wy bardzo dziękuję dzień dobry tego przez który która które jeszcze kiedy "
+          "gdzie dlaczego był była było będzie dzisiaj tutaj myślę że powinniśmy się spotkać jutro czy ktoś wie "
+          "gdzie kupić bilety bardzo dziękuję szybką odpowiedź możemy chcemy zawsze nic wszyscy ten czas rok "
+          "nowy naprawdę wczoraj niestety coś",
+    'cs': "a se na v je že to s z do o k i jsem ale jak by pro tak jsou jeho které který která po už si co jako "
+          "nebo při od jen byl byla bylo děkuji dobrý den ano ne proč kde kdy velmi dnes tady myslím že bychom "
+          "se měli zítra sejít ví někdo kde koupit lístky moc děkuji rychlou odpověď můžeme chceme vždycky nic "
+          "všichni tento čas rok nový opravdu včera bohužel něco ještě když protože",
+    'ro': "și de în a la cu nu pe o un că se din mai care este sunt pentru ce am sau dar ca fi lui ei el ea noi "
+          "voi eu tu mulțumesc bună ziua foarte acest această când unde cum astăzi aici cred că ar trebui să ne "
+          "întâlnim mâine știe cineva de unde să cumpăr bilete mulțumesc mult răspunsul rapid putem vrem mereu "
+          "nimic toți acest timp an nou într-adevăr ieri din păcate ceva și dacă pentru",
+    'hu': "a az és hogy nem is egy de van meg ez csak már el mint ami ha volt még én te ő mi ti ők köszönöm jó "
+          "napot igen miért hol mikor nagyon lesz kell vagy minden ma itt szerintem holnap találkoznunk kellene "
+          "tudja valaki hol lehet jegyet venni köszönöm szépen gyors választ tudunk akarunk mindig semmi "
+          "mindenki ez idő év új tényleg tegnap sajnos valami azt ezt nekem neked",
+    'fi': "ja on ei se että hän oli ovat mutta kun niin kuin myös ole jos tämä joka hänen sen minä sinä me te "
+          "he kiitos hyvää päivää kyllä miksi missä milloin hyvin vielä nyt sitten kanssa tänään täällä "
+          "mielestäni meidän pitäisi tavata huomenna tietääkö joku mistä voi ostaa lippuja kiitos paljon "
+          "nopeasta vastauksesta voimme haluamme aina ei mitään kaikki tämä aika vuosi uusi todella eilen "
+          "valitettavasti jotain",
+    'tr': "bir ve bu da de için ne çok ile ben sen o biz siz onlar var yok gibi daha ama değil mi ki kadar "
+          "olarak sonra şey her evet hayır teşekkürler merhaba nasıl neden şimdi burada iyi güzel olan oldu "
+          "olur benim senin onun bize size bugün bence yarın buluşmalıyız biletleri nereden alabileceğimi bilen "
+          "var mı hızlı cevap için çok teşekkürler yapabiliriz istiyoruz her zaman hiçbir şey herkes bu zaman "
+          "yıl yeni gerçekten dün maalesef bir şey",
+    'id': "yang dan di itu dengan untuk tidak ini dari dalam akan pada juga saya ke karena tersebut bisa ada "
+          "mereka lebih kata kami sudah anda telah oleh atau saat harus sangat bagaimana apa terima kasih "
+          "selamat pagi tapi jika kita aku kamu hari sini saya pikir kita harus bertemu besok ada yang tahu di "
+          "mana membeli tiket terima kasih banyak atas jawabannya bisa ingin selalu tidak ada semua ini waktu "
+          "tahun baru benar-benar kemarin sayangnya sesuatu",
+    'vi': "và của có là không được một người những các trong cho này đã với để khi thì cũng như tôi bạn anh em "
+          "chúng ta họ cảm ơn xin chào vâng tại sao ở đâu rất nhiều hôm nay đây tôi nghĩ chúng ta nên gặp nhau "
+          "vào ngày mai có ai biết mua vé ở đâu không cảm ơn rất nhiều câu trả lời nhanh có thể muốn luôn luôn "
+          "không có gì tất cả này thời gian năm mới thật sự hôm qua tiếc là cái gì",
+    'ru': "и в не на я быть он с что а по это она этот к но они мы как из у который то за свой весь год от так "
+          "о для ты же все тот мочь вы человек такой его сказать только или ещё бы себя один уже до время если "
+          "сам когда другой вот говорить наш мой знать стать при чтобы дело жизнь кто первый очень два день её "
+          "новый даже во со спасибо привет пожалуйста да нет почему где сегодня хорошо есть было будет их я "
+          "думаю нам стоит встретиться завтра кто-нибудь знает где купить билеты большое спасибо за быстрый "
+          "ответ можем хотим всегда ничего этот время новый действительно вчера к сожалению что-то",
+    'uk': "і в не на я бути він з що а по це вона цей до але вони ми як із у який то за свій весь рік від так "
+          "про для ти же все той могти ви людина такий його сказати тільки або ще би себе один вже коли інший "
+          "ось говорити наш мій знати стати щоб справа життя хто перший дуже два день її новий навіть дякую "
+          "привіт будь ласка ні чому де сьогодні добре є має було буде їх я думаю нам варто зустрітися завтра "
+          "хтось знає де купити квитки дуже дякую за швидку відповідь можемо хочемо завжди нічого цей час новий "
+          "справді вчора на жаль щось також тому який яка які",
+    'bg': "и в не на аз съм той с че а по това тя този към но те ние как от у който за свой всички година така "
+          "ти всичко онзи можете вие човек такъв негов каза само или още би себе си един вече кога друг ето "
+          "говори наш мой знае стана при да живот кой първи много две ден нейният нов дори благодаря здравей "
+          "моля защо къде днес добре е са бяха ще мисля че трябва да се срещнем утре някой знае ли къде да купя "
+          "билети много благодаря за бързия отговор можем искаме винаги нищо този време нов наистина вчера за "
+          "съжаление нещо също защото",
+    'ar': "في من على أن إلى عن هذا هذه التي الذي ما لا مع كان كل هو هي بين قد ذلك أو بعد لم عند كما إذا نحن أنت "
+          "أنا هم شكرا مرحبا نعم لماذا أين اليوم جيد جدا الله أعتقد أننا يجب أن نلتقي غدا هل يعرف أحد أين يمكن "
+          "شراء التذاكر شكرا جزيلا على الرد السريع نستطيع نريد دائما لا شيء الجميع هذا الوقت سنة جديد حقا أمس "
+          "للأسف شيء",
+    'fa': "و در به از که این را با است برای آن یک خود تا کرد بر هم نیز گفت شود ما من تو او آنها می شده بود کند "
+          "دارد شما سپاس سلام بله نه چرا کجا امروز خوب خیلی هست نیست چه فکر می کنم باید فردا همدیگر را ببینیم "
+          "کسی می داند کجا می توان بلیط خرید خیلی ممنون برای پاسخ سریع می توانیم می خواهیم همیشه هیچ همه این "
+          "زمان سال جدید واقعا دیروز متاسفانه چیزی",
+}
+
+# Scripts whose letters identify the language on their own
+SCRIPT_LANGUAGES = {
+    'Hangul': 'ko', 'Kana': 'ja', 'Han': 'zh', 'Thai': 'th', 'Hebrew': 'he', 'Greek': 'el',
+    'Georgian': 'ka', 'Armenian': 'hy', 'Devanagari': 'hi', 'Bengali': 'bn', 'Tamil': 'ta',
+    'Gujarati': 'gu', 'Khmer': 'km', 'Ethiopic': 'am',
+}
+
+# (first code point, script) pairs, each range running up to the next entry
+SCRIPT_RANGES = [
+    (0x0000, None), (0x0041, 'Latin'), (0x005B, None), (0x0061, 'Latin'), (0x007B, None),
+    (0x00C0, 'Latin'), (0x0250, None), (0x0370, 'Greek'), (0x0400, 'Cyrillic'), (0x0530, 'Armenian'),
+    (0x0590, 'Hebrew'), (0x0600, 'Arabic'), (0x0700, None), (0x0750, 'Arabic'), (0x0780, None),
+    (0x0900, 'Devanagari'), (0x0980, 'Bengali'), (0x0A00, None), (0x0A80, 'Gujarati'), (0x0B00, None),
+    (0x0B80, 'Tamil'), (0x0C00, None), (0x0E00, 'Thai'), (0x0E80, None), (0x10A0, 'Georgian'),
+    (0x1100, 'Hangul'), (0x1200, 'Ethiopic'), (0x13A0, None), (0x1780, 'Khmer'), (0x1800, None),
+    (0x1E00, 'Latin'), (0x1F00, 'Greek'), (0x2000, None), (0x3040, 'Kana'), (0x3100, None),
+    (0x3400, 'Han'), (0x4DC0, None), (0x4E00, 'Han'), (0xA000, None), (0xAC00, 'Hangul'), (0xD7B0, None),
+    (0xF900, 'Han'), (0xFB00, None), (0xFB50, 'Arabic'), (0xFE00, None), (0xFE70, 'Arabic'), (0xFF00, None),
+]
+
+
+class LanguageIdentifier:
+    """Offline language identification from Unicode scripts and character trigram profiles
+
+    Scripts used by a single language decide on their own; Latin, Cyrillic
+    and Arabic texts are scored against trigram profiles built from
+    LANGUAGE_SEED_WORDS. Texts with too few letters are reported as 'und'.
+    """
+    NOISE_PATTERN = re.compile(r'https?://\S+|[@#]\w+')
+    WORD_PATTERN = re.compile(r'[^\W\d_]+')
+
+    def __init__(self, min_letters=3, smoothing=0.5):
+        self.min_letters = min_letters
+        self.languages = list(LANGUAGE_SEED_WORDS)
+        self.script_starts = [start for start, _ in SCRIPT_RANGES]
+        self.script_names = [script for _, script in SCRIPT_RANGES]
+
+        counts = defaultdict(Counter)
+        scripts = {}
+        for language, words in LANGUAGE_SEED_WORDS.items():
+            for rank, word in enumerate(words.split()):
+                # Frequent words weigh more, roughly following Zipf's law
+                weight = 1.0 / (1 + rank) ** 0.5
+                for trigram in self._trigrams(word):
+                    counts[trigram][language] += weight
+            scripts.setdefault(self._dominant_script(words), []).append(language)
+
+        self.trigram_index = {trigram: index for index, trigram in enumerate(counts)}
+        matrix = np.zeros((len(counts), len(self.languages)), dtype=np.float32)
+        for trigram, index in self.trigram_index.items():
+            for language, count in counts[trigram].items():
+                matrix[index, self.languages.index(language)] = count
+        totals = matrix.sum(axis=0)
+        self.matrix = np.log((matrix + smoothing) / (totals + smoothing * len(counts)))
+
+        # Per script, -inf for languages written in another script
+        self.script_masks = {}
+        for script, languages in scripts.items():
+            mask = np.full(len(self.languages), -np.inf, dtype=np.float32)
+            mask[[self.languages.index(language) for language in languages]] = 0
+            self.script_masks[script] = mask
+
+    def identify(self, text):
+        return self.identify_batch([text])[0]
+
+    def identify_batch(self, texts):
+        """Language code for each text, scoring all trigram lookups of the batch in one step"""
+        results = ['und'] * len(texts)
+        indices = []
+        offsets = []
+        scored = []
+        for position, text in enumerate(texts):
+            text = self.NOISE_PATTERN.sub(' ', text)
+            script, letters = self._dominant_script(text, with_count=True)
+            if letters < self.min_letters or script is None:
+                continue
+            if script == 'Han' and self._has_kana(text):
+                script = 'Kana'
+            if script in SCRIPT_LANGUAGES:
+                results[position] = SCRIPT_LANGUAGES[script]
+                continue
+            if script not in self.script_masks:
+                continue
+            text_indices = [
+                self.trigram_index[trigram]
+                for word in self.WORD_PATTERN.findall(text.lower())
+                for trigram in self._trigrams(word)
+                if trigram in self.trigram_index
+            ]
+            if not text_indices:
+                continue
+            offsets.append(len(indices))
+            indices.extend(text_indices)
+            scored.append((position, script))
+
+        if scored:
+            scores = np.add.reduceat(self.matrix[indices], offsets, axis=0)
+            for (position, script), row in zip(scored, scores):
+                results[position] = self.languages[int(np.argmax(row + self.script_masks[script]))]
+        return results
+
+    @staticmethod
+    def _trigrams(word):
+        padded = f" {word} "
+        return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    def _dominant_script(self, text, with_count=False):
+        counts = Counter()
+        for char in text:
+            if char.isalpha():
+                counts[self.script_names[bisect_right(self.script_starts, ord(char)) - 1]] += 1
+        counts.pop(None, None)
+        script, letters = counts.most_common(1)[0] if counts else (None, 0)
+        return (script, letters) if with_count else script
+
+    @staticmethod
+    def _has_kana(text):
+        return any(0x3040 <= ord(char) < 0x3100 for char in text)
+
+
+@lru_cache(maxsize=None)
+def _language_identifier():
+    """Shared LanguageIdentifier, built on first use"""
+    return LanguageIdentifier()
+
+
+# Function words left out of keyword counts
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been but by can could did do does for from had has have he her
+here him his how i if in into is it its just me more my no not now of on or our out she so some than that the
+their them then there these they this to too up us was we were what when where which who why will with would you
+your
+aber als am an auch auf aus bei bin bis bist da das dass dem den der des die doch du ein eine einem einen einer es
+für hat ich ihr im in ist ja mich mit nach nicht noch nur oder sich sie sind so und uns von war was wie wir zu zum
+au aux avec ce ces dans de des du elle en est et eux il ils je la le les leur lui ma mais me mes moi mon ne nos
+nous on ou par pas pour qu que qui sa se ses son sur ta te tu un une vos vous
+al como con de del el ella en es esta este la las le lo los me mi no nos para pero por que se su sus te tu un una
+uno y ya
+che di e gli ha il io la le lo ma mi non per più se si sono ti un una
+ao as da das de do dos e em eu isso mas na nas no nos não o os para por que se um uma você
+dat de die een en het ik in is je met niet op te van voor wat ze zijn
+а без бы в вы да для до его ее её же за и из или им их к как ли мы на не нет но о об он она они оно от по с со так
+та те то ты у уже что это я
+і але в ви від до з за й на не ні по та так ти то у це що як я
+""".split())
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter sketch keeping at most `capacity` counters
+
+    Each reported count overestimates the true count by at most its error,
+    and any item missing from the sketch occurred at most min_count() times.
+    Sketches built on different shards or runs can be merged.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counters = {}
+        self.heap = []
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def add(self, item, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+            heapq.heappush(self.heap, (count, item))
+            return
+
+        # Evict the smallest counter; the newcomer inherits its count as error
+        minimum, evicted = self._pop_min()
+        del self.counters[evicted]
+        self.counters[item] = [minimum + count, minimum]
+        heapq.heappush(self.heap, (minimum + count, item))
+
+    def _pop_min(self):
+        # Heap entries go stale as counters grow; refresh them until the top is current
+        while True:
+            count, item = heapq.heappop(self.heap)
+            current = self.counters[item][0]
+            if current == count:
+                return count, item
+            heapq.heappush(self.heap, (current, item))
+
+    def min_count(self):
+        """Upper bound on the count of any item not in the sketch"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def most_common(self, n=None):
+        return [(item, count) for item, count, _ in self.top(n)]
+
+    def top(self, n=None):
+        """Top items as (item, count, error) with true count in [count - error, count]"""
+        # Ties broken by item, so every scan order reports the same items
+        items = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(item, count, error) for item, (count, error) in items[:n]]
+
+    def __len__(self):
+        return len(self.counters)
+
+    def merge(self, other):
+        """Fold another sketch into this one (mergeable summaries, Agarwal et al.)"""
+        own_floor, other_floor = self.min_count(), other.min_count()
+        merged = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(item, (own_floor, own_floor))
+            other_count, other_error = other.counters.get(item, (other_floor, other_floor))
+            merged[item] = [count + other_count, error + other_error]
+        self.total += other.total
+        self.capacity = max(self.capacity, other.capacity)
+        # Ties broken by item so merging the same partials always keeps the same counters
+        kept = sorted(merged.items(), key=lambda item: (-item[1][0], item[0]))[:self.capacity]
+        self.counters = dict(kept)
+        self.heap = [(count, item) for item, (count, _) in kept]
+        heapq.heapify(self.heap)
+        return self
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'total': self.total,
+            'items': [[item, count, error] for item, count, error in self.top()]
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.total = data['total']
+        sketch.counters = {item: [count, error] for item, count, error in data['items']}
+        sketch.heap = [(count, item) for item, count, _ in data['items']]
+        heapq.heapify(sketch.heap)
+        return sketch
+
+
+def _heavy_hitters(sketch_size):
+    """Exact Counter, or a Space-Saving sketch when a memory budget is given"""
+    return SpaceSaving(sketch_size) if sketch_size else Counter()
+
+
+def _merge_heavy_hitters(data, other_data, keys):
+    for key in keys:
+        if isinstance(data[key], SpaceSaving):
+            data[key].merge(other_data[key])
+        else:
+            data[key].update(other_data[key])
+
+
+def _finalize_heavy_hitters(data, keys, top_n):
+    """Replace sketches in `data` with their top items and keep the sketches for merging"""
+    for key in keys:
+        if isinstance(data[key], SpaceSaving):
+            data.setdefault('sketches', {})[key] = data[key].to_dict()
+            data[key] = dict(data[key].most_common(top_n))
+
+
+def merge_sketch_files(paths):
+    """Merge the sketches saved in several analysis artifacts, keyed by counter name"""
+    merged = {}
+    for path in paths:
+        sketches = read_analysis(path).get('sketches', {})
+        for key, sketch in sketches.items():
+            sketch = SpaceSaving.from_dict(sketch)
+            merged[key] = merged[key].merge(sketch) if key in merged else sketch
+    return merged
+
+
+class ContentAnalyzer(MessageConsumer):
+    """Analyze message content"""
+    name = 'content'
+
+    def __init__(self, sentiment_workers=None, sentiment_batch_size=256, sentiment_cache_size=50000,
+                 language_batch_size=1000, sketch_size=None, top_n=100, stopwords=STOPWORDS):
+        self.sentiment = SentimentEngine(sentiment_workers, sentiment_batch_size, sentiment_cache_size)
+        self.language_batch_size = language_batch_size
+        self.language_batch = []
+        self.top_n = top_n
+        self.stopwords = stopwords or frozenset()
+        self.data = {
+            'hashtags': _heavy_hitters(sketch_size),
+            'mentions': _heavy_hitters(sketch_size),
+            'keywords': _heavy_hitters(sketch_size),
+            'languages': Counter(),
+            'sentiment': {},
+            'emoji_usage': Counter()
+        }
+
+    def process(self, message):
+        if message.text:
+            tokens = tokenize_text(message.text, message.entities)
+
+            # Hashtags and mentions
+            self.data['hashtags'].update(tokens.hashtags)
+            self.data['mentions'].update(tokens.mentions)
+
+            # Keywords (simple implementation)
+            self.data['keywords'].update([word for word in tokens.keywords if word not in self.stopwords])
+
+            # Language detection, identified offline in batches
+            self.language_batch.append(message.text)
+            if len(self.language_batch) >= self.language_batch_size:
+                self._identify_languages()
+
+            # Sentiment analysis, scored in batches off the scan
+            self.sentiment.submit(message.sender_id, message.text)
+
+            # Emoji analysis
+            self.data['emoji_usage'].update(tokens.emojis)
+
+    def finalize(self):
+        self._identify_languages()
+        self.data['sentiment'] = self.sentiment.results()
+        _finalize_heavy_hitters(self.data, ['hashtags', 'mentions', 'keywords'], self.top_n)
+        return self.data
+
+    def merge(self, other):
+        other._identify_languages()
+        _merge_heavy_hitters(self.data, other.data, ['hashtags', 'mentions', 'keywords'])
+        self.data['languages'].update(other.data['languages'])
+        self.data['emoji_usage'].update(other.data['emoji_usage'])
+        self.sentiment.merge(other.sentiment)
+        return self
+
+    async def drain(self, wait_all=False):
+        await self.sentiment.drain(wait_all)
+
+    def close(self):
+        self.sentiment.close()
+
+    def __getstate__(self):
+        # Partials from analysis workers arrive fully identified, so merging them stays cheap
+        self._identify_languages()
+        return self.__dict__.copy()
+
+    def _identify_languages(self):
+        if self.language_batch:
+            self.data['languages'].update(_language_identifier().identify_batch(self.language_batch))
+            self.language_batch = []
+
+
+# Analyzers that can be enabled by name: MessageConsumer subclasses, or 'module:Class'
+# paths of plugins that are only imported once the analyzer is enabled
+ANALYZERS = {}
+DEFAULT_ANALYZERS = ['messages', 'media', 'network', 'content']
+
+
+def register_analyzer(name, analyzer):
+    """Make an analyzer selectable by name; `analyzer` is a MessageConsumer subclass or 'module:Class'"""
+    ANALYZERS[name] = analyzer
+
+
+def load_analyzer(name):
+    """MessageConsumer subclass registered under `name`, importing a plugin module on first use"""
+    analyzer = ANALYZERS.get(name)
+    if analyzer is None:
+        raise ValueError(f"Unknown analyzer: {name} (available: {', '.join(sorted(ANALYZERS))})")
+    if isinstance(analyzer, str):
+        module_name, _, class_name = analyzer.partition(':')
+        analyzer = ANALYZERS[name] = getattr(importlib.import_module(module_name), class_name)
+    return analyzer
+
+
+for _analyzer in (MessageAnalyzer, MediaAnalyzer, NetworkAnalyzer, ContentAnalyzer):
+    register_analyzer(_analyzer.name, _analyzer)
+
+
+class HistorySample:
+    """Stratified random sample of id windows from a message history, scaled up to group totals
+
+    The ids in (low_id, top_id] are cut into windows of `window` consecutive
+    ids (one API page each) and the windows into `strata` contiguous strata,
+    so every period of the group's life is represented. Each round draws one
+    unsampled window per stratum at random. Totals are estimated per stratum
+    from the mean count per window (deleted ids simply count zero) with the
+    stratified variance and finite population correction; means, such as
+    sentiment, are ratios of two totals with a linearized variance.
+    """
+    def __init__(self, low_id, top_id, window=100, strata=20, confidence=0.95, seed=None):
+        self.window = window
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        window_count = max(0, -(-(top_id - low_id) // window))
+        # At least two windows per stratum, or its variance cannot be estimated
+        strata = max(1, min(strata, window_count // 2))
+        random_source = random.Random(seed)
+        self.unsampled = []
+        for index in range(strata if window_count else 0):
+            starts = [low_id + i * window for i in range(window_count * index // strata,
+                                                         window_count * (index + 1) // strata)]
+            random_source.shuffle(starts)
+            self.unsampled.append(starts)
+        self.sizes = [len(starts) for starts in self.unsampled]
+        self.top_id = top_id
+        # Counter of statistics per sampled window, per stratum
+        self.samples = [[] for _ in self.unsampled]
+        self.rounds = 0
+
+    def draw(self):
+        """(stratum, min_id, max_id) of the next round's windows, exclusive bounds; empty once all are sampled"""
+        windows = []
+        for stratum, starts in enumerate(self.unsampled):
+            if starts:
+                start = starts.pop()
+                windows.append((stratum, start, min(start + self.window, self.top_id) + 1))
+        if windows:
+            self.rounds += 1
+        return windows
+
+    def add(self, stratum, counts):
+        self.samples[stratum].append(counts)
+
+    def keys(self):
+        return set().union(*(counts for samples in self.samples for counts in samples))
+
+    def _total(self, values_of):
+        """Estimated total and its variance from per-window values"""
+        total = variance = 0.0
+        for size, samples in zip(self.sizes, self.samples):
+            if not samples:
+                continue
+            values = np.array([values_of(counts) for counts in samples], dtype=float)
+            total += size * values.mean()
+            if len(values) > 1:
+                variance += size * size * (1 - len(values) / size) * values.var(ddof=1) / len(values)
+        return total, variance
+
+    def _interval(self, estimate, variance, digits):
+        margin = self.z * float(variance) ** 0.5
+        return {'estimate': round(float(estimate), digits), 'low': round(float(estimate) - margin, digits),
+                'high': round(float(estimate) + margin, digits)}
+
+    def total(self, key):
+        """Estimated group-wide count of `key` with its confidence interval"""
+        estimate, variance = self._total(lambda counts: counts[key])
+        interval = self._interval(estimate, variance, 1)
+        interval['low'] = max(interval['low'], 0.0)
+        return interval
+
+    def ratio(self, numerator, denominator):
+        """Estimated ratio of two totals, e.g. a mean per message, with its confidence interval"""
+        top, _ = self._total(lambda counts: counts[numerator])
+        bottom, _ = self._total(lambda counts: counts[denominator])
+        if not bottom:
+            return None
+        ratio = top / bottom
+        _, variance = self._total(lambda counts: counts[numerator] - ratio * counts[denominator])
+        return self._interval(ratio, variance / bottom ** 2, 4)
+
+    def relative_error(self, keys=('messages',)):
+        """Largest half-width of the confidence intervals of some totals, relative to their estimates"""
+        errors = []
+        for key in keys:
+            estimate, variance = self._total(lambda counts: counts[key])
+            errors.append(self.z * float(variance) ** 0.5 / estimate if estimate else float('inf'))
+        return max(errors)
+
+    def rounds_needed(self, accuracy, keys=('messages',)):
+        """Rounds for a relative error of `accuracy`; the error shrinks with the square root of the sample"""
+        error = self.relative_error(keys)
+        if error == float('inf'):
+            return max(self.sizes, default=0)
+        return math.ceil(self.rounds * (error / accuracy) ** 2)
+
+    def common_keys(self, share=0.05):
+        """Media statistics counting at least `share` of the messages; rarer ones would need a near census"""
+        messages = self.total('messages')['estimate']
+        return ['messages'] + sorted((key for key in self.keys() if isinstance(key, tuple)
+                                      and key[0] == 'media' and self.total(key)['estimate'] >= share * messages),
+                                     key=str)
+
+
+class ChartTimeout(Exception):
+    pass
+
+
+def _raise_chart_timeout(signum, frame):
+    raise ChartTimeout()
+
+
+def _init_chart_worker():
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+
+def _save_figure(path):
+    import matplotlib.pyplot as plt
+    # Write then rename so an aborted render never leaves a truncated image
+    tmp_path = f"{path}.tmp.png"
+    plt.savefig(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _render_chart(budget, render, *args):
+    """Run one chart render, aborting it once its time budget is spent"""
+    import matplotlib.pyplot as plt
+    timed = bool(budget) and hasattr(signal, 'SIGALRM')
+    if timed:
+        signal.signal(signal.SIGALRM, _raise_chart_timeout)
+        signal.setitimer(signal.ITIMER_REAL, budget)
+    try:
+        render(*args)
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        plt.close('all')
+
+
+def _render_activity_hours(path, hours):
+    import matplotlib.pyplot as plt
+    plt.figure(figsize=(12, 6))
+    plt.bar(list(hours.keys()), list(hours.values()))
+    plt.title('Message Activity by Hour')
+    _save_figure(path)
+
+
+def _render_hashtag_cloud(path, frequencies):
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
+    wordcloud = WordCloud(width=800, height=400,
+                          background_color='white').generate_from_frequencies(frequencies)
+    plt.figure(figsize=(10, 5))
+    plt.imshow(wordcloud, interpolation='bilinear')
+    plt.axis('off')
+    plt.title('Hashtag Cloud')
+    _save_figure(path)
+
+
+def _load_layout(path):
+    try:
+        with open(path) as f:
+            return {node: tuple(xy) for node, xy in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def _render_network(path, layout_path, sources, targets, weights, ranks, top_n, label_n):
+    """Draw the reply graph restricted to the top_n users by PageRank"""
+    import matplotlib.pyplot as plt
+    import networkx as nx
+    top = sorted(ranks, key=ranks.get, reverse=True)[:top_n]
+    keep = np.isin(sources, top) & np.isin(targets, top)
+
+    G = nx.Graph()
+    G.add_nodes_from(str(user) for user in top)
+    for source, target, weight in zip(sources[keep].tolist(), targets[keep].tolist(), weights[keep].tolist()):
+        source, target = str(source), str(target)
+        if G.has_edge(source, target):
+            G[source][target]['weight'] += weight
+        else:
+            G.add_edge(source, target, weight=weight)
+
+    # Users already placed on a previous run keep their position; only new ones are laid out
+    layout = _load_layout(layout_path)
+    pos = {node: layout[node] for node in G if node in layout}
+    if len(pos) < len(G):
+        pos = nx.spring_layout(G, pos=pos or None, fixed=list(pos) or None,
+                               weight='weight', seed=42)
+        layout.update((node, tuple(map(float, xy))) for node, xy in pos.items())
+        with open(layout_path, 'w') as f:
+            json.dump(layout, f)
+
+    sizes = np.array([ranks[int(node)] for node in G])
+    plt.figure(figsize=(12, 12))
+    nx.draw_networkx_edges(G, pos, alpha=0.3,
+                           width=[0.5 + np.log1p(w) for _, _, w in G.edges(data='weight')])
+    nx.draw_networkx_nodes(G, pos, node_color='lightblue',
+                           node_size=100 + 2000 * sizes / max(sizes.max(), 1e-12))
+    nx.draw_networkx_labels(G, pos, labels={str(user): str(user) for user in top[:label_n]}, font_size=8)
+    plt.title(f'User Interaction Network (top {len(top)} users by PageRank)')
+    plt.axis('off')
+    _save_figure(path)
+
+
+def _pool_future(loop, pool, function, *args):
+    """Run function on a multiprocessing pool and return an asyncio future of its result"""
+    future = loop.create_future()
+
+    def settle(setter):
+        # Called on the pool's result thread; the future may have been cancelled by a timeout meanwhile
+        return lambda value: loop.call_soon_threadsafe(lambda: future.done() or setter(value))
+
+    pool.apply_async(function, args, callback=settle(future.set_result), error_callback=settle(future.set_exception))
+    return future
+
+
+class ChartRenderer:
+    """Renders charts in a process pool, off the event loop, one time budget per chart"""
+
+    def __init__(self, workers=None, time_budget=60, network_top_n=150, network_labels=30):
+        self.workers = workers if workers is not None else max(1, (os.cpu_count() or 2) - 1)
+        self.time_budget = time_budget
+        self.network_top_n = network_top_n
+        self.network_labels = network_labels
+
+    def jobs(self, output_dir, data):
+        """Chart name -> (render function, args) for the analysis data; disabled analyzers have no charts"""
+        jobs = {}
+        if 'messages' in data and data['messages']['activity_hours']:
+            jobs['activity_hours'] = (_render_activity_hours, (
+                f"{output_dir}/activity_hours.png", dict(data['messages']['activity_hours'])))
+        edges = data['network']['edges'] if 'network' in data else ()
+        if len(edges):
+            jobs['network_graph'] = (_render_network, (
+                f"{output_dir}/network_graph.png", f"{output_dir}/network_layout.json",
+                edges.column('from_user').copy(), edges.column('to_user').copy(),
+                edges.column('weight').copy(), data['network']['influence_scores'],
+                self.network_top_n, self.network_labels))
+        if 'content' in data and data['content']['hashtags']:
+            jobs['hashtag_cloud'] = (_render_hashtag_cloud, (
+                f"{output_dir}/hashtag_cloud.png", dict(data['content']['hashtags'])))
+        return jobs
+
+    async def render(self, output_dir, data):
+        """Render all charts; returns chart name -> None on success or the exception raised"""
+        jobs = self.jobs(output_dir, data)
+        if not jobs:
+            return {}
+        if not self.workers:
+            # Inline rendering for debugging; signals only reach the main thread, so no budget
+            results = {}
+            for name, (render, args) in jobs.items():
+                try:
+                    _render_chart(None, render, *args)
+                    results[name] = None
+                except Exception as e:
+                    results[name] = e
+            return results
+
+        loop = asyncio.get_running_loop()
+        workers = min(self.workers, len(jobs))
+        # Backstop for a worker that ignores its alarm: every queued chart gets its full budget
+        deadline = self.time_budget * -(-len(jobs) // workers) + 5 if self.time_budget else None
+        pool = multiprocessing.Pool(workers, initializer=_init_chart_worker)
+        try:
+            futures = [_pool_future(loop, pool, _render_chart, self.time_budget, render, *args)
+                       for render, args in jobs.values()]
+            outcomes = await asyncio.gather(
+                *(asyncio.wait_for(future, deadline) for future in futures), return_exceptions=True)
+        finally:
+            # A worker still rendering past the deadline is killed, not left to finish or to hold up exit
+            pool.terminate()
+        return dict(zip(jobs, outcomes))
+
+
+# Set in analysis worker processes, which are the parallelism already, so the
+# analyzers there do their CPU work inline instead of starting pools of their own
+_analysis_worker = False
+
+
+def _init_analysis_worker():
+    global _analysis_worker
+    _analysis_worker = True
+
+
+def _analyze_batch(specs, records):
+    """Feed records to fresh analyzers built from (class, options) specs; runs in an analysis worker
+
+    Returns the analyzers as partial aggregates, and the seconds each one spent.
+    """
+    consumers = [consumer_class(**options) for consumer_class, options in specs]
+    timings = Counter()
+    for record in records:
+        for consumer in consumers:
+            start = time.perf_counter()
+            try:
+                consumer.process(record)
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Error in {consumer.name} analysis: {str(e)}")
+            timings[consumer.name] += time.perf_counter() - start
+    return consumers, timings
+
+
+class AnalysisPipeline:
+    """Analyzes batches of records on a process pool behind a bounded queue, so fetching and analysis overlap
+
+    The scan put()s batches of records for a target, a dict holding the
+    'consumers' to merge into. Worker tasks hand each batch to a worker
+    process, which analyzes it with fresh analyzers and sends them back as
+    partial aggregates. Partials are merged into the target in the order
+    their batches were put, so results match an in-process scan, and the
+    target's 'offset_id' then moves to the batch's last message. At most
+    queue_size batches are held at once, queued, being analyzed or waiting
+    to be merged; put() waits for a free slot, which holds back the fetch
+    and bounds memory.
+    """
+
+    def __init__(self, specs, workers=None, queue_size=None, batch_size=1000, on_merge=None):
+        self.specs = specs
+        self.workers = workers if workers is not None else max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = batch_size
+        self.on_merge = on_merge
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(queue_size or self.workers * 2)
+        # Batches per target in the order they were put
+        self.pending = {}
+        self.executor = None
+        self.tasks = []
+        self.error = None
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_analysis_worker)
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def put(self, target, records, offset_id=None):
+        """Queue a batch of records for analysis into target['consumers'], waiting while the queue is full"""
+        await self.slots.acquire()
+        if self.error:
+            self.slots.release()
+            raise self.error
+        batch = {'target': target, 'records': records, 'count': len(records), 'offset_id': offset_id, 'result': None}
+        self.pending.setdefault(id(target), deque()).append(batch)
+        self.queue.put_nowait(batch)
+
+    async def join(self):
+        """Wait until every batch is merged; raises the first failure"""
+        await self.queue.join()
+        if self.error:
+            raise self.error
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.queue.get()
+            try:
+                batch['result'] = await loop.run_in_executor(self.executor, _analyze_batch, self.specs, batch['records'])
+            except Exception as e:
+                batch['result'] = e
+            batch['records'] = None
+            try:
+                self._merge_ready(batch['target'])
+            except Exception as e:
+                self.error = self.error or e
+            finally:
+                self.queue.task_done()
+
+    def _merge_ready(self, target):
+        # Merge from the oldest batch on, stopping at the first one still being analyzed
+        batches = self.pending[id(target)]
+        metrics = current_metrics()
+        while batches and batches[0]['result'] is not None:
+            batch = batches.popleft()
+            self.slots.release()
+            if isinstance(batch['result'], Exception):
+                raise batch['result']
+            partials, timings = batch['result']
+            for consumer, partial in zip(target['consumers'], partials):
+                consumer.merge(partial)
+            if batch['offset_id'] is not None:
+                target['offset_id'] = batch['offset_id']
+            for name, seconds in timings.items():
+                metrics.stages[name] += seconds
+            if self.on_merge:
+                self.on_merge(metrics, batch['count'])
+
+
+class RunMetrics:
+    """Stage timers and counters of one analysis run, exported as JSON and Prometheus text
+
+    Stages accumulate wall time: 'members', 'fetch' (time with a page request
+    or rate-limit wait of the scan outstanding, counted once however many
+    shards wait at the same time), one per analyzer (processing plus
+    finalize), 'save', 'charts' and 'report'.
+    """
+    PREFIX = 'telegram_analyzer'
+
+    def __init__(self, group=None):
+        self.group = group
+        self.started = time.time()
+        self.seconds = 0.0
+        self.stages = defaultdict(float)
+        self.counters = Counter()
+        self.progress_task = None
+        # Overlapping uses in flight and when the first of them started, per stage
+        self.active = Counter()
+        self.opened = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    @contextmanager
+    def overlapping(self, name):
+        """Like stage(), for concurrent waits: only the span during which any of them is open counts"""
+        if not self.active[name]:
+            self.opened[name] = time.perf_counter()
+        self.active[name] += 1
+        try:
+            yield
+        finally:
+            self.active[name] -= 1
+            if not self.active[name]:
+                self.stages[name] += time.perf_counter() - self.opened[name]
+
+    def finish(self):
+        self.seconds = time.time() - self.started
+
+    @staticmethod
+    def peak_rss_bytes(children=False):
+        """Peak resident memory of this process, or with `children` of its largest finished worker process
+
+        Worker pools (sentiment, charts, analysis) only count once they have been shut down.
+        """
+        try:
+            import resource
+        except ImportError:
+            return None
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def to_dict(self):
+        seconds = self.seconds or time.time() - self.started
+        return {
+            'group': self.group,
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'seconds': round(seconds, 3),
+            'messages': self.counters['messages'],
+            'messages_per_sec': round(self.counters['messages'] / seconds, 1) if seconds else 0.0,
+            'api_requests': self.counters['api_requests'],
+            'api_retries': self.counters['api_retries'],
+            'flood_waits': self.counters['flood_waits'],
+            'flood_wait_seconds': self.counters['flood_wait_seconds'],
+            'peak_rss_bytes': self.peak_rss_bytes(),
+            'peak_worker_rss_bytes': self.peak_rss_bytes(children=True),
+            'stages': {name: round(value, 3) for name, value in sorted(self.stages.items())}
+        }
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        group = str(self.group).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {self.PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {self.PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join([f'group="{group}"'] + [f'{key}="{val}"' for key, val in labels.items()])
+                lines.append(f"{self.PREFIX}_{name}{{{label_text}}} {value}")
+
+        metric('run_timestamp_seconds', 'gauge', "Start of the run (Unix time)", [({}, self.started)])
+        metric('run_seconds', 'gauge', "Wall time of the run", [({}, data['seconds'])])
+        metric('stage_seconds', 'gauge', "Wall time spent per stage",
+               [({'stage': name}, value) for name, value in data['stages'].items()])
+        metric('messages_total', 'counter', "Messages analyzed", [({}, data['messages'])])
+        metric('messages_per_second', 'gauge', "Messages analyzed per second of the run",
+               [({}, data['messages_per_sec'])])
+        metric('api_requests_total', 'counter', "Telegram API requests", [({}, data['api_requests'])])
+        metric('api_retries_total', 'counter', "Telegram API requests retried after errors",
+               [({}, data['api_retries'])])
+        metric('flood_waits_total', 'counter', "FloodWait errors received", [({}, data['flood_waits'])])
+        metric('flood_wait_seconds_total', 'counter', "Seconds of FloodWait imposed",
+               [({}, data['flood_wait_seconds'])])
+        if data['peak_rss_bytes'] is not None:
+            metric('peak_rss_bytes', 'gauge', "Peak resident memory of the main process",
+                   [({}, data['peak_rss_bytes'])])
+            metric('peak_worker_rss_bytes', 'gauge', "Peak resident memory of the largest finished worker process",
+                   [({}, data['peak_worker_rss_bytes'])])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_dir):
+        with open(f"{output_dir}/metrics.json", 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=4)
+        with open(f"{output_dir}/metrics.prom", 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+
+
+# Metrics of the analysis running in the current task; asyncio tasks inherit it,
+# so concurrent groups in a batch each count their own requests
+_current_metrics = contextvars.ContextVar('metrics', default=None)
+
+
+def current_metrics():
+    """RunMetrics of the analysis running in this task, started on first use"""
+    metrics = _current_metrics.get()
+    if metrics is None:
+        metrics = RunMetrics()
+        _current_metrics.set(metrics)
+    return metrics
+
+
+class ThroughputColumn(ProgressColumn):
+    def render(self, task):
+        return Text(f"{task.speed or 0:,.0f} msg/s")
+
+
+# Errors after which an API request is worth repeating
+TRANSIENT_ERRORS = (ConnectionError, asyncio.TimeoutError, ServerError, TimedOutError)
+
+
+class RateLimiter:
+    """Token bucket shared by every API call made through one client
+
+    `rate` requests per second are allowed on average with bursts of up to
+    `burst`; rate=None only enforces FloodWaits. A FloodWait reported by any
+    caller blocks all callers until it has passed, then the request is retried.
+    Transient errors are retried by the failing caller alone, with exponential
+    backoff, up to `max_retries` times in a row.
+    """
+
+    def __init__(self, rate=20, burst=20, max_retries=5, backoff=1, max_backoff=60):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for one request slot"""
+        # Waiters queue on the lock, so slots are handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                if self.rate is None:
+                    current_metrics().counters['api_requests'] += 1
+                    return
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    current_metrics().counters['api_requests'] += 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def flood_wait(self, seconds):
+        """Block every caller for a FloodWait reported by Telegram"""
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def _recover(self, error, retries):
+        """Wait before retrying after `error`; False once the request should fail"""
+        counters = current_metrics().counters
+        if isinstance(error, FloodWaitError):
+            # Telegram says exactly how long to wait, so these never exhaust the retries
+            counters['flood_waits'] += 1
+            counters['flood_wait_seconds'] += error.seconds
+            self.flood_wait(error.seconds)
+            return True
+        counters['api_retries'] += 1
+        if retries > self.max_retries:
+            return False
+        delay = min(self.max_backoff, self.backoff * 2 ** (retries - 1))
+        logging.getLogger(__name__).warning(f"Retrying in {delay}s after {type(error).__name__}: {str(error)}")
+        await asyncio.sleep(delay * random.uniform(0.5, 1))
+        return True
+
+    async def call(self, function, *args, **kwargs):
+        """Await one API request, retrying it after FloodWaits and transient errors"""
+        retries = 0
+        while True:
+            await self.acquire()
+            try:
+                return await function(*args, **kwargs)
+            except (FloodWaitError,) + TRANSIENT_ERRORS as e:
+                retries += not isinstance(e, FloodWaitError)
+                if not await self._recover(e, retries):
+                    raise
+
+    async def iterate(self, resume, per_request=100, stage=None):
+        """Iterate a paginated API listing, one slot per page of `per_request` items
+
+        `resume(last)` returns the async iterator to read, continuing after the
+        last item already yielded (None at the start); it is called again to
+        carry on after a FloodWait or transient error. The waits for slots and
+        items, but not the caller's work between items, are added to the
+        RunMetrics stage named `stage`.
+        """
+        timer = (lambda: current_metrics().overlapping(stage)) if stage else nullcontext
+        last = None
+        retries = 0
+        while True:
+            with timer():
+                await self.acquire()
+            count = 0
+            try:
+                items = resume(last).__aiter__()
+                while True:
+                    with timer():
+                        try:
+                            item = await items.__anext__()
+                        except StopAsyncIteration:
+                            return
+                    yield item
+                    last = item
+                    count += 1
+                    if count % per_request == 0:
+                        with timer():
+                            await self.acquire()
+            except (FloodWaitError,) + TRANSIENT_ERRORS as e:
+                if count:
+                    retries = 0
+                retries += not isinstance(e, FloodWaitError)
+                if not await self._recover(e, retries):
+                    raise
+
+
 class TelegramAnalyzer:
-    def __init__(self, api_id, api_hash, phone):
+    def __init__(self, api_id, api_hash, phone, use_store=True, output_dir="telegram_analysis", analyzer_options=None,
+                 chart_options=None, artifact_format='ndjson', rate_limit=20, checkpoint_interval=300,
+                 shards=1, message_filter=None, sample_options=None, analyzers=None, session=None, charts=True,
+                 pipeline_options=None):
         self.api_id = api_id
         self.api_hash = api_hash
         self.phone = phone
-        self.client = TelegramClient(phone, api_id, api_hash)
+        # Offline analyzers (dump replay) run without a Telegram client; the session file
+        # (by default named after the phone number) keeps the login between runs
+        self.client = TelegramClient(session or phone, api_id, api_hash) if api_id else None
+        # All requests, from every group analyzed at once, share one bucket;
+        # FloodWaits are left to it instead of Telethon sleeping per request
+        self.limiter = RateLimiter(rate=rate_limit)
+        if self.client:
+            self.client.flood_sleep_threshold = 0
         self.console = Console()
-        self.output_dir = "telegram_analysis"
+        self.output_dir = output_dir
+        self.use_store = use_store
+        self.artifact_format = artifact_format
+        # Seconds between checkpoints of a message scan without the store; None disables them
+        self.checkpoint_interval = checkpoint_interval
+        # Concurrently fetched message-id ranges of a scan without the store
+        self.shards = max(1, shards)
+        # Time window and message kind to analyze, pushed down to the fetch where possible
+        self.message_filter = message_filter or MessageFilter()
+        # Estimate from a sample of the history instead of reading all of it, e.g.
+        # {'accuracy': 0.05, 'time_budget': 120}; see _sample_messages
+        self.sample_options = sample_options
+        # Analysis on worker processes while the fetch goes on, e.g. {'workers': 4, 'queue_size': 8,
+        # 'batch_size': 1000}; None analyzes in-process. See AnalysisPipeline
+        self.pipeline_options = pipeline_options
         Path(self.output_dir).mkdir(exist_ok=True)
         
         # Setup logging
@@ -36,9 +2639,33 @@ class TelegramAnalyzer:
         )
         self.logger = logging.getLogger(__name__)
 
-    async def initialize(self):
-        """Initialize the client and connect"""
+        # RunMetrics per group directory, and the live throughput display they share
+        self.metrics = {}
+        self.progress = None
+        self._progress_runs = 0
+        # State per watched group id while watch_groups runs
+        self._live = {}
+
+        # Analyzers fed by the single message scan, by registered name
+        self.consumer_classes = [load_analyzer(name) for name in analyzers or DEFAULT_ANALYZERS]
+        # Keyword arguments per analyzer name, e.g. {'messages': {'timezone': 'Europe/Berlin'}}
+        self.analyzer_options = analyzer_options or {}
+        # Chart rendering pool, e.g. {'workers': 2, 'time_budget': 30, 'network_top_n': 100}
+        self.charts = ChartRenderer(**(chart_options or {})) if charts else None
+
+    async def initialize(self, interactive=True):
+        """Initialize the client and connect
+
+        Without `interactive` nothing is prompted for: the saved session must
+        already be logged in, otherwise this fails.
+        """
         try:
+            if not interactive:
+                await self.client.connect()
+                if not await self.client.is_user_authorized():
+                    self.logger.error("Session is not logged in; log in once with --login")
+                    return False
+                return True
             await self.client.start()
             if not await self.client.is_user_authorized():
                 await self.client.send_code_request(self.phone)
@@ -51,52 +2678,388 @@ class TelegramAnalyzer:
 
     async def analyze_group(self, group):
         """Complete group analysis"""
-        group_dir = f"{self.output_dir}/{self._clean_filename(group.title)}"
+        group_dir = self._group_dir(group.title)
         Path(group_dir).mkdir(exist_ok=True)
         
         self.console.print(f"\n[bold green]Starting analysis for {group.title}[/bold green]")
         
         try:
-            # Basic member data
-            members_data = await self._get_members_data(group)
-            
-            # Message analysis
-            messages_data = await self._analyze_messages(group)
-            
-            # Media analysis
-            media_data = await self._analyze_media(group)
-            
-            # Network analysis
-            network_data = await self._analyze_network(group)
-            
-            # Content analysis
-            content_data = await self._analyze_content(group)
-            
-            # Save all analyses
-            await self._save_analysis(group_dir, {
-                'members': members_data,
-                'messages': messages_data,
-                'media': media_data,
-                'network': network_data,
-                'content': content_data
-            })
-            
-            # Generate visualizations
-            await self._generate_visualizations(group_dir, {
-                'messages': messages_data,
-                'network': network_data,
-                'content': content_data
-            })
+            with self._track_run(group_dir, group.title, f"Analyzing {group.title}"):
+                # Member data and the message pass (message, media, network and content
+                # analysis) run side by side so their API waits overlap
+                if self.sample_options is not None:
+                    members_data, sample_data = await asyncio.gather(
+                        self._timed('members', self._get_members_data(group)),
+                        self._timed('sample', self._sample_messages(group, **self.sample_options))
+                    )
+                    # Estimates only: the per-message analyses and their charts need the full history
+                    await self._timed('save', self._save_analysis(group_dir, {'members': members_data,
+                                                                              'sample': sample_data}))
+                    return
+
+                members_data, analysis_data = await asyncio.gather(
+                    self._timed('members', self._get_members_data(group)),
+                    self._analyze_messages(group, group_dir)
+                )
+
+                # Save all analyses while the charts render; both run off the event loop
+                await asyncio.gather(
+                    self._timed('save', self._save_analysis(group_dir, {'members': members_data, **analysis_data})),
+                    self._timed('charts', self._generate_visualizations(group_dir, analysis_data))
+                )
             
         except Exception as e:
             self.logger.error(f"Error analyzing group {group.title}: {str(e)}")
+            raise
+
+    @contextmanager
+    def _track_run(self, group_dir, title, description):
+        """Collect RunMetrics for one analysis, show its live throughput and write them at the end"""
+        metrics = RunMetrics(title)
+        token = _current_metrics.set(metrics)
+        self.metrics[group_dir] = metrics
+        if not self._progress_runs:
+            self.progress = Progress(
+                TextColumn("{task.description}"), BarColumn(), TextColumn("{task.completed:,} messages"),
+                ThroughputColumn(), TimeElapsedColumn(), console=self.console
+            )
+            self.progress.start()
+        self._progress_runs += 1
+        metrics.progress_task = self.progress.add_task(description, total=None)
+        try:
+            yield metrics
+        finally:
+            self.progress.remove_task(metrics.progress_task)
+            metrics.progress_task = None
+            self._progress_runs -= 1
+            if not self._progress_runs:
+                self.progress.stop()
+            _current_metrics.reset(token)
+            metrics.finish()
+            self._write_metrics(group_dir, metrics)
+            self.console.print(f"{title}: {metrics.counters['messages']:,} messages in {metrics.seconds:.1f}s "
+                               f"({metrics.to_dict()['messages_per_sec']:,.0f} msg/s)")
+
+    def _write_metrics(self, group_dir, metrics):
+        try:
+            metrics.write(group_dir)
+        except Exception as e:
+            self.logger.warning(f"Error writing metrics for {group_dir}: {str(e)}")
+
+    @staticmethod
+    async def _timed(stage, awaitable):
+        with current_metrics().stage(stage):
+            return await awaitable
+
+    async def _analyze_messages(self, group, group_dir):
+        consumers = self._create_consumers(group_dir)
+        if not self.use_store:
+            # The store keeps sync progress by itself; a direct scan needs checkpoints
+            checkpoint = f"{group_dir}/scan_checkpoint.pkl" if self.checkpoint_interval else None
+            return await self._scan_messages(group, consumers, checkpoint, group_dir)
+
+        store = MessageStore(f"{group_dir}/messages.db")
+        try:
+            with current_metrics().stage('fetch'):
+                synced = await self._sync_messages(group, store)
+            self.console.print(f"Synced {synced} new messages for {group.title} ({store.count()} stored)")
+            window = self.message_filter
+            return await self._analyze_records(store.iter_records(since=window.since, until=window.until),
+                                               self._start_consumers(consumers), group_dir)
+        finally:
+            store.close()
+
+    async def analyze_groups(self, groups, concurrency=4):
+        """Analyze many groups at once on the shared client, at most `concurrency` at a time
+
+        A failing group does not stop the others; returns one result per group
+        with its status, duration and error, also saved to batch_results.json.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(group):
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    await self.analyze_group(group)
+                    await self.generate_report(self._group_dir(group.title))
+                    error = None
+                except Exception as e:
+                    error = f"{type(e).__name__}: {str(e)}"
+                metrics = self.metrics.get(self._group_dir(group.title))
+                return {
+                    'group': group.title,
+                    'id': group.id,
+                    'status': 'failed' if error else 'ok',
+                    'seconds': round(time.monotonic() - start, 2),
+                    'messages': metrics.counters['messages'] if metrics else 0,
+                    'api_requests': metrics.counters['api_requests'] if metrics else 0,
+                    'error': error
+                }
+
+        results = await asyncio.gather(*(run(group) for group in groups))
+
+        table = Table(title="Batch analysis")
+        for column in ['Group', 'Status', 'Seconds', 'Messages', 'Requests', 'Error']:
+            table.add_column(column)
+        for result in results:
+            status = "[green]ok[/green]" if result['status'] == 'ok' else "[red]failed[/red]"
+            table.add_row(result['group'], status, f"{result['seconds']:.1f}", f"{result['messages']:,}",
+                          f"{result['api_requests']:,}", result['error'] or "")
+        self.console.print(table)
+        if self.limiter.flood_waits:
+            self.console.print(f"FloodWaits: {self.limiter.flood_waits} ({self.limiter.flood_wait_seconds}s)")
+
+        with open(f"{self.output_dir}/batch_results.json", 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        return results
+
+    async def watch_groups(self, groups, snapshot_interval=60, rebuild_interval=3600):
+        """Keep the analyses of `groups` current from new, edited and deleted message events
+
+        Each group is caught up once through its message store. From then on
+        only events are processed, so API traffic grows with new messages and
+        not with group size: new messages go straight into the in-memory
+        analyzers, edits and deletions into the store. Every snapshot_interval
+        seconds, groups with changes are finalized on a copy of their analyzers
+        and saved for generate_report. Edits and deletions reach the analyses
+        when they are rebuilt from the store, at most every rebuild_interval
+        seconds, on a worker thread while events keep being processed. Members
+        and charts keep their last full analysis. Runs until cancelled, then
+        saves a last snapshot.
+        """
+        self._live = {}
+        for group in groups:
+            group_dir = self._group_dir(group.title)
+            Path(group_dir).mkdir(exist_ok=True)
+            members_path = find_analysis(group_dir, 'members')
+            self.metrics[group_dir] = RunMetrics(group.title)
+            self._live[group.id] = {
+                'group': group,
+                'dir': group_dir,
+                'store': MessageStore(f"{group_dir}/messages.db"),
+                'members': {'members': read_analysis(members_path)} if members_path else {},
+                'metrics': self.metrics[group_dir],
+                # None until caught up; events before that only update the store
+                'consumers': None,
+                'seen_id': 0,
+                'corrections': 0,
+                'rebuilt_at': 0.0,
+                'changed': False,
+                # Background rebuild task, and the event that stops its worker thread at shutdown
+                'rebuild': None,
+                'stop': threading.Event()
+            }
+
+        handlers = [
+            (self._on_new_message, events.NewMessage),
+            (self._on_message_edited, events.MessageEdited),
+            (self._on_message_deleted, events.MessageDeleted)
+        ]
+        for handler, event in handlers:
+            self.client.add_event_handler(handler, event(chats=list(self._live)))
+        try:
+            await asyncio.gather(*(self._start_live(state) for state in self._live.values()))
+            self.console.print(f"[green]Watching {len(self._live)} groups[/green]")
+            while True:
+                await asyncio.sleep(snapshot_interval)
+                await self._live_snapshots(rebuild_interval)
+        finally:
+            for handler, _ in handlers:
+                self.client.remove_event_handler(handler)
+            for state in self._live.values():
+                state['stop'].set()
+            await asyncio.gather(*(state['rebuild'] for state in self._live.values() if state['rebuild']))
+            try:
+                await self._live_snapshots(rebuild_interval)
+            finally:
+                for state in self._live.values():
+                    for consumer in state['consumers'] or ():
+                        consumer.close()
+                    state['store'].close()
+                self._live = {}
+
+    async def _start_live(self, state):
+        token = _current_metrics.set(state['metrics'])
+        try:
+            with state['metrics'].stage('fetch'):
+                synced = await self._sync_messages(state['group'], state['store'])
+            await self._rebuild_live(state)
+            self.console.print(f"Caught up {state['group'].title}: {synced} new messages")
+        finally:
+            _current_metrics.reset(token)
+
+    async def _rebuild_live(self, state, catch_up=1000):
+        """Rebuild the analyses of a watched group from its store, off the event loop
+
+        Fresh analyzers are fed the stored messages up to the newest stored id
+        on a worker thread, while new messages keep going to the current ones,
+        and then those stored meanwhile, until at most `catch_up` ids are left.
+        These are fed on the loop and the fresh analyzers swapped in, without
+        awaiting in between, so no event slips through.
+        """
+        store = state['store']
+        loop = asyncio.get_running_loop()
+        corrections = state['corrections']
+        consumers, fed_id, through_id = None, None, store.max_id()
+        while True:
+            consumers = await loop.run_in_executor(
+                None, contextvars.copy_context().run, self._build_live, state, consumers, fed_id, through_id)
+            if consumers is None:
+                return
+            fed_id, through_id = through_id, store.max_id()
+            if through_id - fed_id <= catch_up:
+                break
+        window = self.message_filter
+        self._feed_records(store.iter_records(since=window.since, until=window.until, after_id=fed_id), consumers)
+        for consumer in state['consumers'] or ():
+            consumer.close()
+        # Edits and deletions that came in meanwhile may have been read too late, so they still count
+        state.update(consumers=consumers, seen_id=max(fed_id, store.max_id()),
+                     corrections=state['corrections'] - corrections, rebuilt_at=time.monotonic(), changed=True)
+
+    def _build_live(self, state, consumers, after_id, through_id):
+        """Feed the stored messages with ids in (after_id, through_id] into `consumers`, fresh ones if None
+
+        Runs on a worker thread; returns the consumers, or None once watching stopped.
+        """
+        # SQLite connections belong to the thread that opened them
+        store = MessageStore(state['store'].path)
+        if consumers is None:
+            consumers = self._start_consumers(self._create_consumers(state['dir']))
+        try:
+            window = self.message_filter
+            records = store.iter_records(since=window.since, until=window.until, after_id=after_id,
+                                         through_id=through_id)
+            self._feed_records(itertools.takewhile(lambda record: not state['stop'].is_set(), records), consumers)
+        finally:
+            store.close()
+        if state['stop'].is_set():
+            for consumer in consumers:
+                consumer.close()
+            return None
+        return consumers
+
+    async def _rebuild_in_background(self, state):
+        token = _current_metrics.set(state['metrics'])
+        try:
+            with state['metrics'].stage('rebuild'):
+                await self._rebuild_live(state)
+        except Exception as e:
+            self.logger.warning(f"Error rebuilding analyses of {state['group'].title}: {str(e)}")
+        finally:
+            state['rebuild'] = None
+            _current_metrics.reset(token)
+
+    async def _live_snapshots(self, rebuild_interval):
+        now = time.monotonic()
+        for state in self._live.values():
+            # Rebuilt analyzers are saved by the first snapshot after they are swapped in
+            if (state['consumers'] is not None and state['corrections'] and state['rebuild'] is None
+                    and not state['stop'].is_set() and now - state['rebuilt_at'] >= rebuild_interval):
+                state['rebuild'] = asyncio.create_task(self._rebuild_in_background(state))
+        await asyncio.gather(*(
+            self._live_snapshot(state) for state in self._live.values()
+            if state['consumers'] is not None and state['changed']
+        ))
+
+    async def _live_snapshot(self, state):
+        """Save the current analyses of one watched group"""
+        token = _current_metrics.set(state['metrics'])
+        try:
+            state['changed'] = False
+            # Pickle on the loop so the copy is consistent, finalize it on a worker thread
+            payload = pickle.dumps(state['consumers'], protocol=pickle.HIGHEST_PROTOCOL)
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, contextvars.copy_context().run, self._finalize_snapshot, payload)
+            await self._timed('save', self._save_analysis(state['dir'], {**state['members'], **results}))
+            self._write_metrics(state['dir'], state['metrics'])
+        except Exception as e:
+            self.logger.warning(f"Error saving snapshot of {state['group'].title}: {str(e)}")
+        finally:
+            _current_metrics.reset(token)
+
+    def _finalize_snapshot(self, payload):
+        return self._finalize(pickle.loads(payload))
+
+    async def _on_new_message(self, event):
+        state = self._live.get(event.chat_id)
+        if state is None:
+            return
+        record = normalize_message(event.message)
+        token = _current_metrics.set(state['metrics'])
+        try:
+            state['store'].add([record])
+            # Ids up to seen_id are already in the analyzers, e.g. when caught up from the store
+            if state['consumers'] is None or record.id <= state['seen_id']:
+                return
+            state['seen_id'] = record.id
+            if not self.message_filter or self.message_filter.matches(record):
+                self._dispatch(record, state['consumers'])
+                state['changed'] = True
+                await self._drain(state['consumers'])
+        except Exception as e:
+            self.logger.warning(f"Error processing new message in {state['group'].title}: {str(e)}")
+        finally:
+            _current_metrics.reset(token)
+
+    async def _on_message_edited(self, event):
+        state = self._live.get(event.chat_id)
+        if state is None:
+            return
+        try:
+            state['store'].add([normalize_message(event.message)])
+            state['corrections'] += 1
+        except Exception as e:
+            self.logger.warning(f"Error storing edited message in {state['group'].title}: {str(e)}")
+
+    async def _on_message_deleted(self, event):
+        # Deletions in basic groups come without a chat; their ids are unique per account
+        if event.chat_id is not None:
+            states = [self._live[event.chat_id]] if event.chat_id in self._live else []
+        else:
+            states = [state for state in self._live.values() if not getattr(state['group'], 'is_channel', False)]
+        for state in states:
+            try:
+                state['corrections'] += state['store'].delete(event.deleted_ids)
+            except Exception as e:
+                self.logger.warning(f"Error removing deleted messages in {state['group'].title}: {str(e)}")
+
+    async def analyze_dump(self, dump_path, title=None):
+        """Run all analyzers from a recorded message dump, without a Telegram connection"""
+        title = title or Path(dump_path).name.split('.')[0]
+        group_dir = self._group_dir(title)
+        Path(group_dir).mkdir(exist_ok=True)
+
+        self.console.print(f"\n[bold green]Replaying {dump_path} as {title}[/bold green]")
+
+        try:
+            with self._track_run(group_dir, title, f"Replaying {title}"):
+                consumers = self._start_consumers(self._create_consumers(group_dir))
+                analysis_data = await self._analyze_records(read_dump(dump_path), consumers, group_dir)
+
+                # Dumps carry messages only, there is no member list to analyze
+                await asyncio.gather(
+                    self._timed('save', self._save_analysis(group_dir, {'members': [], **analysis_data})),
+                    self._timed('charts', self._generate_visualizations(group_dir, analysis_data))
+                )
+
+        except Exception as e:
+            self.logger.error(f"Error replaying {dump_path}: {str(e)}")
             self.console.print(f"[red]Error during analysis: {str(e)}[/red]")
 
+        return group_dir
+
     async def _get_members_data(self, group):
         """Get detailed member information"""
         members_data = []
         
-        async for user in self.client.iter_participants(group):
+        seen = set()
+        # A FloodWait restarts the member listing, so skip users already processed
+        async for user in self.limiter.iterate(lambda last: self.client.iter_participants(group), per_request=200):
+            if user.id in seen:
+                continue
+            seen.add(user.id)
             try:
                 member = {
                     'id': user.id,
@@ -117,242 +3080,490 @@ class TelegramAnalyzer:
                 
         return members_data
 
-    async def _analyze_messages(self, group):
-        """Analyze message patterns and activity"""
-        message_data = {
-            'activity_hours': defaultdict(int),
-            'activity_days': defaultdict(int),
-            'user_activity': defaultdict(int),
-            'reply_patterns': defaultdict(list),
-            'forward_patterns': defaultdict(int),
-            'reactions': defaultdict(lambda: defaultdict(int)),
-            'message_types': defaultdict(int)
-        }
-        
-        async for message in self.client.iter_messages(group, limit=None):
-            try:
-                # Time analysis
-                if message.date:
-                    message_data['activity_hours'][message.date.hour] += 1
-                    message_data['activity_days'][message.date.strftime('%A')] += 1
-                
-                # User activity
-                if message.sender_id:
-                    message_data['user_activity'][message.sender_id] += 1
-                
-                # Reply patterns
-                if message.reply_to:
-                    message_data['reply_patterns'][message.sender_id].append(message.reply_to.reply_to_msg_id)
-                
-                # Forwards
-                if message.forward:
-                    message_data['forward_patterns'][message.forward.from_id] += 1
-                
-                # Reactions
-                if message.reactions:
-                    for reaction in message.reactions.results:
-                        message_data['reactions'][message.sender_id][reaction.reaction] += 1
-                
-                # Message types
-                message_data['message_types'][type(message.media).__name__ if message.media else 'text'] += 1
-                
-            except Exception as e:
-                self.logger.warning(f"Error processing message: {str(e)}")
-                
-        return message_data
-
-    async def _analyze_media(self, group):
-        """Analyze media content"""
-        media_data = {
-            'photos': [],
-            'videos': [],
-            'files': [],
-            'links': [],
-            'voice_messages': [],
-            'stickers': []
-        }
-        
-        async for message in self.client.iter_messages(group, limit=None):
-            try:
-                if message.media:
-                    if isinstance(message.media, MessageMediaPhoto):
-                        media_data['photos'].append({
-                            'id': message.id,
-                            'date': message.date.isoformat(),
-                            'sender_id': message.sender_id,
-                            'file_size': message.file.size if message.file else None
-                        })
-                    elif isinstance(message.media, MessageMediaDocument):
-                        if message.media.document.mime_type.startswith('video'):
-                            media_data['videos'].append({
-                                'id': message.id,
-                                'date': message.date.isoformat(),
-                                'sender_id': message.sender_id,
-                                'file_size': message.file.size if message.file else None,
-                                'duration': getattr(message.media.document.attributes[0], 'duration', None)
-                            })
-                        elif message.media.document.mime_type.startswith('audio'):
-                            media_data['voice_messages'].append({
-                                'id': message.id,
-                                'date': message.date.isoformat(),
-                                'sender_id': message.sender_id,
-                                'duration': getattr(message.media.document.attributes[0], 'duration', None)
-                            })
-                
-                # Extract links
-                if message.text:
-                    urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', 
-                                    message.text)
-                    for url in urls:
-                        media_data['links'].append({
-                            'url': url,
-                            'domain': urlparse(url).netloc,
-                            'sender_id': message.sender_id,
-                            'date': message.date.isoformat()
-                        })
-                        
-            except Exception as e:
-                self.logger.warning(f"Error processing media: {str(e)}")
-                
-        return media_data
+    def register_consumer(self, consumer_class):
+        """Add an analyzer to the set fed by the message scan"""
+        self.consumer_classes.append(consumer_class)
 
-    async def _analyze_network(self, group):
-        """Analyze user interaction network"""
-        network_data = {
-            'interactions': [],
-            'user_centrality': {},
-            'communities': [],
-            'influence_scores': {}
+    def _consumer_specs(self, group_dir=None):
+        """(class, options) of every analyzer of a scan"""
+        specs = []
+        for consumer_class in self.consumer_classes:
+            options = dict(self.analyzer_options.get(consumer_class.name, {}))
+            # spill=True asks for a per-group detail file next to the analyses
+            if options.get('spill') is True:
+                options['spill'] = f"{group_dir}/{consumer_class.name}_details.ndjson" if group_dir else None
+            specs.append((consumer_class, options))
+        return specs
+
+    def _create_consumers(self, group_dir=None):
+        return [consumer_class(**options) for consumer_class, options in self._consumer_specs(group_dir)]
+
+    def _create_pipeline(self, consumers, group_dir=None):
+        """AnalysisPipeline for a scan into `consumers`, or None to analyze them in-process"""
+        if not self.pipeline_options or self.pipeline_options.get('workers') == 0:
+            return None
+        if any(type(consumer).merge is MessageConsumer.merge for consumer in consumers):
+            self.logger.warning("Analyzing in-process: not every analyzer can merge partial results")
+            return None
+        return AnalysisPipeline(self._consumer_specs(group_dir), on_merge=self._count_messages,
+                                **self.pipeline_options)
+
+    @staticmethod
+    def _start_consumers(consumers):
+        for consumer in consumers:
+            consumer.start()
+        return consumers
+
+    async def _sync_messages(self, group, store, batch_size=1000):
+        """Fetch only messages not yet stored into the local store
+
+        The store holds every message with an id in (floor_id, max_id]. A window
+        starting before the floor backfills the older ids first, and the sync of
+        newer messages stops at the end of the window. Message kinds are not
+        pushed down here, so the store stays complete for later runs.
+        """
+        window = self.message_filter
+        low_id = await self._last_id_before(group, window.since) if window.since is not None else 0
+        floor_id = store.get_meta('floor_id')
+        if floor_id is None:
+            # Stores from older versions were always synced from the first message
+            floor_id = low_id if not store.count() else 0
+        synced = 0
+        if low_id < floor_id:
+            synced += await self._fetch_range(group, store, low_id, floor_id + 1, batch_size)
+            floor_id = low_id
+        store.set_meta('floor_id', floor_id)
+        synced += await self._fetch_range(group, store, max(store.max_id(), floor_id), 0, batch_size, window.until)
+        return synced
+
+    async def _fetch_range(self, group, store, min_id, max_id, batch_size, until=None):
+        """Store the messages with ids in (min_id, max_id), max_id 0 meaning no upper bound
+
+        Messages are fetched oldest first, so the stored max id never skips over
+        unfetched messages, and fetching stops at the first one dated `until` or later.
+        """
+        synced = 0
+        batch = []
+        messages = self.limiter.iterate(lambda last: self.client.iter_messages(
+            group, min_id=last.id if last else min_id, max_id=max_id, reverse=True))
+        async for message in messages:
+            if until is not None and message.date and message.date.timestamp() >= until:
+                break
+            batch.append(normalize_message(message))
+            if len(batch) >= batch_size:
+                store.add(batch)
+                synced += len(batch)
+                batch = []
+        await messages.aclose()
+        store.add(batch)
+        return synced + len(batch)
+
+    async def _sample_messages(self, group, accuracy=None, time_budget=None, window=100, strata=20,
+                               confidence=0.95, top_n=20, seed=None):
+        """Estimate activity, media, hashtag and sentiment totals from a stratified sample of the history
+
+        Rounds of random id windows (see HistorySample) are fetched until the
+        confidence intervals of the message count and of the media totals above
+        5% of messages are within `accuracy` of their estimates,
+        or until the next round would exceed `time_budget` seconds, whichever
+        comes first; without either, the accuracy is 5%. After two pilot rounds
+        the number of rounds is chosen from the observed variance and round time.
+        """
+        if accuracy is None and time_budget is None:
+            accuracy = 0.05
+        window_filter = self.message_filter
+        low_id = await self._last_id_before(group, window_filter.since) if window_filter.since is not None else 0
+        if window_filter.until is not None:
+            top_id = await self._last_id_before(group, window_filter.until)
+        else:
+            latest = await self.limiter.call(self.client.get_messages, group, limit=1)
+            top_id = latest[0].id if latest else 0
+
+        sample = HistorySample(low_id, top_id, window, strata, confidence, seed)
+        zone = ZoneInfo(self.analyzer_options.get('messages', {}).get('timezone') or 'UTC')
+        metrics = current_metrics()
+        start = time.monotonic()
+        content_options = self.analyzer_options.get('content', {})
+        # Sampled texts are scored on the shared sentiment pool and cache, each window under its own key
+        sentiment = SentimentEngine(content_options.get('sentiment_workers'),
+                                    content_options.get('sentiment_batch_size', 256),
+                                    content_options.get('sentiment_cache_size', 50000))
+        planned = stopped_by = None
+        try:
+            while True:
+                windows = sample.draw()
+                if not windows:
+                    stopped_by = 'exhausted'
+                    break
+                await asyncio.gather(*(
+                    self._sample_window(group, sample, stratum, min_id, max_id, zone, sentiment)
+                    for stratum, min_id, max_id in windows
+                ))
+                if metrics.progress_task is not None:
+                    self.progress.update(metrics.progress_task, completed=metrics.counters['messages'])
+                if sample.rounds < 2:
+                    continue
+                round_seconds = (time.monotonic() - start) / sample.rounds
+                targets = []
+                if accuracy is not None:
+                    targets.append((sample.rounds_needed(accuracy, sample.common_keys()), 'accuracy'))
+                if time_budget is not None:
+                    targets.append((int(time_budget / round_seconds) if round_seconds else sample.rounds, 'time_budget'))
+                planned, stopped_by = min(targets)
+                if sample.rounds >= planned:
+                    break
+        finally:
+            sentiment.close()
+
+        keys = sample.keys()
+        hashtags = Counter({key[1]: sample.total(key)['estimate'] for key in keys if key[0] == 'hashtag'})
+        sampled_windows = sum(len(samples) for samples in sample.samples)
+        return {
+            'method': {
+                'id_range': [low_id, top_id],
+                'window': window,
+                'strata': len(sample.sizes),
+                'windows': sum(sample.sizes),
+                'sampled_windows': sampled_windows,
+                'sampled_fraction': round(sampled_windows / sum(sample.sizes), 4) if sample.sizes else 0,
+                'rounds': sample.rounds,
+                'planned_rounds': planned,
+                'stopped_by': stopped_by,
+                'confidence': confidence,
+                'relative_error': round(float(sample.relative_error(sample.common_keys())), 4) if sampled_windows else None,
+                'seconds': round(time.monotonic() - start, 2)
+            },
+            'messages': sample.total('messages'),
+            'activity_hours': {hour: sample.total(('hour', hour)) for hour in range(24)},
+            'activity_days': {day: sample.total(('day', day)) for day in ActivityTimeline.WEEKDAYS},
+            'media': {key[1]: sample.total(key) for key in sorted(
+                key for key in sample.keys() if isinstance(key, tuple) and key[0] == 'media')},
+            'hashtags': {tag: sample.total(('hashtag', tag)) for tag, _ in hashtags.most_common(top_n)},
+            'sentiment': sample.ratio('polarity', 'scored')
         }
-        
-        # Create a network graph
-        G = nx.Graph()
-        
-        async for message in self.client.iter_messages(group, limit=None):
-            try:
-                if message.reply_to:
-                    network_data['interactions'].append({
-                        'from_user': message.sender_id,
-                        'to_user': message.reply_to.reply_to_msg_id,
-                        'type': 'reply',
-                        'date': message.date.isoformat()
-                    })
-                    G.add_edge(message.sender_id, message.reply_to.reply_to_msg_id)
-                    
-            except Exception as e:
-                self.logger.warning(f"Error in network analysis: {str(e)}")
-        
-        # Calculate network metrics
+
+    async def _sample_window(self, group, sample, stratum, min_id, max_id, zone, sentiment):
+        """Fetch one sampled id window and add its counts to the sample"""
+        window_filter = self.message_filter
+        counts = Counter()
+        key = ('window', stratum, min_id)
+        metrics = current_metrics()
+        messages = self.limiter.iterate(lambda last: self.client.iter_messages(
+            group, limit=None, min_id=min_id, max_id=last.id if last else max_id,
+            filter=window_filter.server_filter()), stage='fetch')
+        async for message in messages:
+            record = normalize_message(message)
+            if window_filter and not window_filter.matches(record):
+                continue
+            counts['messages'] += 1
+            metrics.counters['messages'] += 1
+            if record.date is not None:
+                moment = datetime.fromtimestamp(record.date, zone)
+                counts['hour', moment.hour] += 1
+                counts['day', ActivityTimeline.WEEKDAYS[moment.weekday()]] += 1
+            kind = media_kind(record)
+            if kind:
+                counts['media', kind] += 1
+            if record.text:
+                tokens = tokenize_text(record.text, record.entities)
+                counts['media', 'links'] += len(tokens.urls)
+                counts.update(('hashtag', tag) for tag in tokens.hashtags)
+                sentiment.submit(key, record.text)
+                await sentiment.drain()
+        with metrics.overlapping('sentiment'):
+            await sentiment.drain(wait_all=True)
+        scores = sentiment.stats.pop(key, None)
+        if scores is not None:
+            counts['polarity'] += scores.mean * scores.count
+            counts['scored'] += scores.count
+        sample.add(stratum, counts)
+
+    async def _last_id_before(self, group, timestamp):
+        """Id of the newest message sent before `timestamp`, 0 if there is none"""
+        messages = await self.limiter.call(self.client.get_messages, group, limit=1, offset_date=_to_datetime(timestamp))
+        return messages[0].id if messages else 0
+
+    async def _scan_messages(self, group, consumers, checkpoint_path=None, group_dir=None):
+        """Fetch the group history once and fan each message out to every consumer
+
+        The history is read as `shards` message-id ranges fetched concurrently,
+        each into its own consumers; the partials are merged newest range first
+        once all are done, so results match a single sequential scan. With a
+        checkpoint path, every shard's partial aggregates and position are saved
+        every checkpoint_interval seconds, and an interrupted scan resumes there.
+        """
+        shards = None
+        window = self.message_filter
+        if checkpoint_path:
+            checkpoint = self._load_checkpoint(checkpoint_path)
+            if checkpoint:
+                shards = checkpoint['shards']
+                # A span like --since 30d resumes with the bounds it was resolved to when the scan started
+                window = MessageFilter(checkpoint['since'], checkpoint['until'], window.kind, window.arguments)
+                self.console.print(f"Resuming {group.title} from checkpoint")
+        if shards is None:
+            shards = await self._plan_shards(group, consumers, window, group_dir)
+            for shard in shards:
+                self._start_consumers(shard['consumers'])
+
+        progress = {'checkpoint_at': time.monotonic()}
+        pipeline = self._create_pipeline(consumers, group_dir)
+        try:
+            if pipeline:
+                pipeline.start()
+            await asyncio.gather(*(
+                self._scan_shard(group, shard, shards, window, checkpoint_path, progress, pipeline) for shard in shards
+            ))
+            if pipeline:
+                await pipeline.join()
+        finally:
+            if pipeline:
+                await pipeline.close()
+
+        # Scores still on the sentiment pool are awaited here, so merge and finalize do not block the loop
+        for shard in shards:
+            await self._drain(shard['consumers'], wait_all=True)
+        consumers = shards[0]['consumers']
+        for shard in shards[1:]:
+            for consumer, partial in zip(consumers, shard['consumers']):
+                consumer.merge(partial)
+        results = self._finalize(consumers)
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return results
+
+    async def _plan_shards(self, group, consumers, window, group_dir=None):
+        """Split the group's message ids, or those of the time window, into self.shards ranges, newest first"""
+        shard_count = self.shards
+        if shard_count > 1 and any(type(consumer).merge is MessageConsumer.merge for consumer in consumers):
+            self.logger.warning("Scanning without shards: not every analyzer can merge partial results")
+            shard_count = 1
+        # Ids grow with time, so the window's edges are the newest ids before since and until
+        low_id = await self._last_id_before(group, window.since) if window.since is not None else 0
+        top_id, open_top = low_id, window.until is None and shard_count == 1
+        if window.until is not None:
+            top_id = await self._last_id_before(group, window.until)
+        elif not open_top:
+            # Splitting needs the newest id, which then pins the scan to the messages posted before it
+            latest = await self.limiter.call(self.client.get_messages, group, limit=1)
+            top_id = latest[0].id if latest else 0
+        if top_id - low_id < shard_count:
+            shard_count = 1
+
+        # Shard i holds ids in (bounds[i], bounds[i + 1]]; min_id and max_id are exclusive
+        bounds = [low_id + (top_id - low_id) * i // shard_count for i in range(shard_count + 1)]
+        shards = []
+        for index in reversed(range(shard_count)):
+            shards.append({
+                'min_id': bounds[index],
+                # A single scan without an end date stays open: it reads up to the newest message
+                # there is when its first page is fetched
+                'max_id': 0 if index == shard_count - 1 and open_top else max(bounds[index + 1], low_id) + 1,
+                'offset_id': 0,
+                'consumers': consumers if index == shard_count - 1 else self._create_consumers(group_dir)
+            })
+        return shards
+
+    async def _scan_shard(self, group, shard, shards, window, checkpoint_path, progress, pipeline=None):
+        # Newest first within the range; offset_id is the last message already in the shard's consumers
+        # A message kind is searched for on the server; matches() re-checks what comes back
+        messages = self.limiter.iterate(lambda last: self.client.iter_messages(
+            group, limit=None, min_id=shard['min_id'],
+            max_id=last.id if last else shard['offset_id'] or shard['max_id'],
+            filter=window.server_filter()), stage='fetch')
+        batch = []
+        async for message in messages:
+            record = normalize_message(message)
+            matches = not window or window.matches(record)
+            if pipeline is None:
+                if matches:
+                    self._dispatch(record, shard['consumers'])
+                    await self._drain(shard['consumers'])
+                shard['offset_id'] = message.id
+            else:
+                # The pipeline moves offset_id once the batch is merged
+                if matches:
+                    batch.append(record)
+                if len(batch) >= pipeline.batch_size:
+                    await pipeline.put(shard, batch, message.id)
+                    batch = []
+            if checkpoint_path and time.monotonic() - progress['checkpoint_at'] >= self.checkpoint_interval:
+                progress['checkpoint_at'] = time.monotonic()
+                await self._save_checkpoint(checkpoint_path, shards, window)
+        if batch:
+            await pipeline.put(shard, batch, batch[-1].id)
+
+    def _checkpoint_key(self):
+        # A checkpoint only resumes a scan with the same analyzers and options
+        return ([f"{cls.__module__}.{cls.__qualname__}" for cls in self.consumer_classes],
+                json.dumps(self.analyzer_options, sort_keys=True, default=str),
+                self.message_filter.key())
+
+    async def _save_checkpoint(self, path, shards, window):
         try:
-            network_data['user_centrality'] = nx.degree_centrality(G)
-            network_data['communities'] = list(nx.community.greedy_modularity_communities(G))
-            network_data['influence_scores'] = nx.pagerank(G)
+            # Pickle on the loop so the snapshot is consistent, write it on a worker thread
+            payload = pickle.dumps({
+                'key': self._checkpoint_key(),
+                'since': window.since,
+                'until': window.until,
+                'shards': shards
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+            await asyncio.get_running_loop().run_in_executor(None, self._write_checkpoint, path, payload)
         except Exception as e:
-            self.logger.warning(f"Error calculating network metrics: {str(e)}")
-            
-        return network_data
-
-    async def _analyze_content(self, group):
-        """Analyze message content"""
-        content_data = {
-            'hashtags': Counter(),
-            'mentions': Counter(),
-            'keywords': Counter(),
-            'languages': Counter(),
-            'sentiment': defaultdict(list),
-            'emoji_usage': Counter()
-        }
-        
-        async for message in self.client.iter_messages(group, limit=None):
+            self.logger.warning(f"Error saving checkpoint {path}: {str(e)}")
+
+    @staticmethod
+    def _write_checkpoint(path, payload):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def _load_checkpoint(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                checkpoint = pickle.load(f)
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable checkpoint {path}: {str(e)}")
+            return None
+        if checkpoint.get('key') != self._checkpoint_key():
+            self.logger.warning(f"Ignoring checkpoint {path} made with different analyzers or filters")
+            return None
+        return checkpoint
+
+    async def _scan_records(self, records, consumers, batch_size=100):
+        """Fan already fetched records out to every consumer, skipping those outside the message filter
+
+        Every batch_size records the loop gets a turn and the consumers are
+        drained, so member fetches, keep-alives and other groups carry on.
+        """
+        if self.message_filter:
+            records = filter(self.message_filter.matches, records)
+        metrics = current_metrics()
+        loading = time.perf_counter()
+        for count, record in enumerate(records, 1):
+            metrics.stages['load'] += time.perf_counter() - loading
+            self._dispatch(record, consumers)
+            if count % batch_size == 0:
+                await self._drain(consumers)
+                await asyncio.sleep(0)
+            loading = time.perf_counter()
+        await self._drain(consumers, wait_all=True)
+        return self._finalize(consumers)
+
+    async def _analyze_records(self, records, consumers, group_dir=None):
+        """_scan_records, on the analysis pipeline when it is enabled"""
+        pipeline = self._create_pipeline(consumers, group_dir)
+        if pipeline is None:
+            return await self._scan_records(records, consumers)
+        if self.message_filter:
+            records = filter(self.message_filter.matches, records)
+        target = {'consumers': consumers}
+        metrics = current_metrics()
+        try:
+            pipeline.start()
+            batch = []
+            loading = time.perf_counter()
+            for record in records:
+                batch.append(record)
+                if len(batch) >= pipeline.batch_size:
+                    metrics.stages['load'] += time.perf_counter() - loading
+                    await pipeline.put(target, batch)
+                    batch = []
+                    loading = time.perf_counter()
+            metrics.stages['load'] += time.perf_counter() - loading
+            if batch:
+                await pipeline.put(target, batch)
+            await pipeline.join()
+        finally:
+            await pipeline.close()
+        return self._finalize(consumers)
+
+    def _feed_records(self, records, consumers):
+        if self.message_filter:
+            records = filter(self.message_filter.matches, records)
+        metrics = current_metrics()
+        loading = time.perf_counter()
+        for record in records:
+            metrics.stages['load'] += time.perf_counter() - loading
+            self._dispatch(record, consumers)
+            loading = time.perf_counter()
+
+    def _dispatch(self, record, consumers):
+        metrics = current_metrics()
+        for consumer in consumers:
+            start = time.perf_counter()
             try:
-                if message.text:
-                    # Hashtags and mentions
-                    hashtags = re.findall(r'#\w+', message.text)
-                    mentions = re.findall(r'@\w+', message.text)
-                    content_data['hashtags'].update(hashtags)
-                    content_data['mentions'].update(mentions)
-                    
-                    # Keywords (simple implementation)
-                    words = message.text.lower().split()
-                    content_data['keywords'].update(words)
-                    
-                    # Language detection
-                    try:
-                        blob = TextBlob(message.text)
-                        content_data['languages'][blob.detect_language()] += 1
-                    except:
-                        pass
-                    
-                    # Sentiment analysis
-                    try:
-                        sentiment = TextBlob(message.text).sentiment.polarity
-                        content_data['sentiment'][message.sender_id].append(sentiment)
-                    except:
-                        pass
-                    
-                    # Emoji analysis
-                    emojis = [c for c in message.text if c in emoji.EMOJI_DATA]
-                    content_data['emoji_usage'].update(emojis)
-                    
+                consumer.process(record)
             except Exception as e:
-                self.logger.warning(f"Error in content analysis: {str(e)}")
-                
-        return content_data
+                self.logger.warning(f"Error in {consumer.name} analysis: {str(e)}")
+            metrics.stages[consumer.name] += time.perf_counter() - start
+        self._count_messages(metrics, 1)
+
+    @staticmethod
+    async def _drain(consumers, wait_all=False):
+        for consumer in consumers:
+            await consumer.drain(wait_all)
+
+    def _count_messages(self, metrics, count):
+        before = metrics.counters['messages']
+        metrics.counters['messages'] += count
+        if metrics.progress_task is not None and before // 500 != metrics.counters['messages'] // 500:
+            self.progress.update(metrics.progress_task, completed=metrics.counters['messages'])
+
+    def _finalize(self, consumers):
+        metrics = current_metrics()
+        results = {}
+        for consumer in consumers:
+            with metrics.stage(consumer.name):
+                results[consumer.name] = consumer.finalize()
+        return results
 
     async def _save_analysis(self, output_dir, data):
         """Save analysis results"""
         try:
-            # Save each analysis type to separate files
+            # Each analysis type is streamed to its own file on a worker thread
+            loop = asyncio.get_running_loop()
+            writes = []
             for analysis_type, analysis_data in data.items():
-                output_file = f"{output_dir}/{analysis_type}_analysis.json"
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(analysis_data, f, ensure_ascii=False, indent=4, default=str)
-                    
+                for suffix in ARTIFACT_FORMATS.values():
+                    stale = Path(f"{output_dir}/{analysis_type}_analysis{suffix}")
+                    if suffix != ARTIFACT_FORMATS[self.artifact_format] and stale.exists():
+                        stale.unlink()
+                output_file = f"{output_dir}/{analysis_type}_analysis{ARTIFACT_FORMATS[self.artifact_format]}"
+                writes.append(loop.run_in_executor(None, write_analysis, analysis_data, output_file))
+            writes.append(loop.run_in_executor(None, self._write_summary, output_dir, summarize_analysis(data)))
+            await asyncio.gather(*writes)
+
             self.console.print(f"[green]Analysis saved to {output_dir}[/green]")
             
         except Exception as e:
             self.logger.error(f"Error saving analysis: {str(e)}")
 
+    @staticmethod
+    def _write_summary(output_dir, summary):
+        with open(f"{output_dir}/summary.json", 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=4)
+
     async def _generate_visualizations(self, output_dir, data):
         """Generate visualization charts"""
+        if self.charts is None:
+            return
         try:
-            # Activity patterns
-            plt.figure(figsize=(12, 6))
-            hours = data['messages']['activity_hours']
-            plt.bar(hours.keys(), hours.values())
-            plt.title('Message Activity by Hour')
-            plt.savefig(f"{output_dir}/activity_hours.png")
-            plt.close()
-            
-            # Network graph
-            if data['network']['interactions']:
-                G = nx.Graph()
-                for interaction in data['network']['interactions']:
-                    G.add_edge(interaction['from_user'], interaction['to_user'])
-                    
-                plt.figure(figsize=(12, 12))
-                nx.draw(G, with_labels=True, node_color='lightblue', 
-                       node_size=500, font_size=8)
-                plt.title('User Interaction Network')
-                plt.savefig(f"{output_dir}/network_graph.png")
-                plt.close()
-                
-            # Word cloud of hashtags
-            if data['content']['hashtags']:
-                from wordcloud import WordCloud
-                wordcloud = WordCloud(width=800, height=400, 
-                                    background_color='white').generate_from_frequencies(
-                                        data['content']['hashtags'])
-                plt.figure(figsize=(10, 5))
-                plt.imshow(wordcloud, interpolation='bilinear')
-                plt.axis('off')
-                plt.title('Hashtag Cloud')
-                plt.savefig(f"{output_dir}/hashtag_cloud.png")
-                plt.close()
-                
+            results = await self.charts.render(output_dir, data)
+            for name, error in results.items():
+                if isinstance(error, (ChartTimeout, asyncio.TimeoutError)):
+                    self.logger.warning(f"Chart {name} exceeded its {self.charts.time_budget}s budget")
+                elif error is not None:
+                    self.logger.warning(f"Error rendering chart {name}: {str(error)}")
         except Exception as e:
             self.logger.error(f"Error generating visualizations: {str(e)}")
 
+    def _group_dir(self, title):
+        return f"{self.output_dir}/{self._clean_filename(title)}"
+
     @staticmethod
     def _clean_filename(filename):
         """Clean filename for saving"""
@@ -361,14 +3572,14 @@ class TelegramAnalyzer:
     # Helper methods for user data
     async def _get_user_bio(self, user):
         try:
-            full = await self.client.get_entity(user.id)
+            full = await self.limiter.call(self.client.get_entity, user.id)
             return full.about if hasattr(full, 'about') else None
         except:
             return None
 
     async def _get_profile_photo_info(self, user):
         try:
-            photos = await self.client.get_profile_photos(user)
+            photos = await self.limiter.call(self.client.get_profile_photos, user)
             return {
                 'has_photo': bool(photos.total),
                 'total_photos': photos.total
@@ -397,34 +3608,43 @@ class TelegramAnalyzer:
 
     async def _get_common_chats(self, user):
         try:
-            common = await self.client.get_common_chats(user)
+            common = await self.limiter.call(self.client.get_common_chats, user)
             return [{'id': chat.id, 'title': chat.title} for chat in common]
         except:
             return []
 
     async def generate_report(self, group_dir):
         """Generate a comprehensive HTML report"""
+        metrics = self.metrics.get(group_dir)
         try:
-            report_data = {}
-            
-            # Load all analysis files
-            for analysis_type in ['members', 'messages', 'media', 'network', 'content']:
-                file_path = f"{group_dir}/{analysis_type}_analysis.json"
-                if os.path.exists(file_path):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        report_data[analysis_type] = json.load(f)
-
-            # Generate HTML report
-            html_content = self._generate_html_report(report_data)
-            
-            # Save report
-            with open(f"{group_dir}/analysis_report.html", 'w', encoding='utf-8') as f:
-                f.write(html_content)
-                
+            with metrics.stage('report') if metrics else nullcontext():
+                self._write_report(group_dir)
             self.console.print(f"[green]Report generated: {group_dir}/analysis_report.html[/green]")
-            
         except Exception as e:
             self.logger.error(f"Error generating report: {str(e)}")
+        if metrics:
+            self._write_metrics(group_dir, metrics)
+
+    def _write_report(self, group_dir):
+        summary_path = f"{group_dir}/summary.json"
+        if os.path.exists(summary_path):
+            with open(summary_path, 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+        else:
+            # Results saved before summaries existed: rebuild it from the full artifacts
+            report_data = {}
+            for analysis_type in ['members', 'messages', 'media', 'network', 'content', 'sample']:
+                file_path = find_analysis(group_dir, analysis_type)
+                if file_path:
+                    report_data[analysis_type] = read_analysis(file_path)
+            summary = summarize_analysis(report_data)
+
+        # Generate HTML report
+        html_content = self._generate_html_report(summary)
+
+        # Save report
+        with open(f"{group_dir}/analysis_report.html", 'w', encoding='utf-8') as f:
+            f.write(html_content)
 
     def _generate_html_report(self, data):
         """Generate HTML report content"""
@@ -445,47 +3665,95 @@ class TelegramAnalyzer:
         </head>
         <body>
             <h1>Telegram Group Analysis Report</h1>
-            
+            {self._generate_sample_stats_html(data.get('sample'))}
+
             <div class="section">
                 <h2>Member Statistics</h2>
-                <p>Total Members: {len(data.get('members', []))}</p>
-                {self._generate_member_stats_html(data.get('members', []))}
+                <p>Total Members: {(data.get('members') or {}).get('total', 0)}</p>
+                {self._generate_member_stats_html(data.get('members'))}
             </div>
 
             <div class="section">
                 <h2>Activity Analysis</h2>
-                {self._generate_activity_stats_html(data.get('messages', {}))}
+                {self._generate_activity_stats_html(data.get('messages'))}
             </div>
 
             <div class="section">
                 <h2>Media Analysis</h2>
-                {self._generate_media_stats_html(data.get('media', {}))}
+                {self._generate_media_stats_html(data.get('media'))}
             </div>
 
             <div class="section">
                 <h2>Network Analysis</h2>
-                {self._generate_network_stats_html(data.get('network', {}))}
+                {self._generate_network_stats_html(data.get('network'))}
             </div>
 
             <div class="section">
                 <h2>Content Analysis</h2>
-                {self._generate_content_stats_html(data.get('content', {}))}
+                {self._generate_content_stats_html(data.get('content'))}
             </div>
         </body>
         </html>
         """
         return html
 
+    def _generate_sample_stats_html(self, sample_data):
+        """Generate HTML for estimates from a sampled history, empty for a full analysis"""
+        if not sample_data:
+            return ""
+
+        method = sample_data['method']
+        confidence = f"{method['confidence']:.0%}"
+
+        def rows(estimates, label=str):
+            return "".join(
+                f"<tr><td>{escape(label(name))}</td><td>{value['estimate']:,.0f}</td>"
+                f"<td>{value['low']:,.0f} – {value['high']:,.0f}</td></tr>"
+                for name, value in estimates.items()
+            )
+
+        def table(title, estimates, label=str):
+            return f"""
+            <h3>{title}</h3>
+            <table>
+                <tr>
+                    <th>{title}</th>
+                    <th>Estimate</th>
+                    <th>{confidence} Interval</th>
+                </tr>
+                {rows(estimates, label)}
+            </table>
+            """
+
+        sentiment = sample_data.get('sentiment')
+        sentiment_html = (
+            f"<p>Mean sentiment polarity: {sentiment['estimate']:.3f} "
+            f"({confidence} interval {sentiment['low']:.3f} – {sentiment['high']:.3f})</p>"
+        ) if sentiment else ""
+        return f"""
+            <div class="section">
+                <h2>Sampled Estimates</h2>
+                <p>Estimated from {method['sampled_windows']:,} of {method['windows']:,} windows of
+                {method['window']} message ids ({method['sampled_fraction']:.1%}) in {method['strata']} time strata;
+                stopped by {method['stopped_by']}. Member statistics are exact.</p>
+                {table('Messages', {'All messages': sample_data['messages']})}
+                {sentiment_html}
+                {table('Hour', sample_data['activity_hours'])}
+                {table('Day', sample_data['activity_days'])}
+                {table('Media Type', sample_data['media'], lambda name: name.replace('_', ' ').title())}
+                {table('Hashtag', sample_data['hashtags'])}
+            </div>
+        """
+
     def _generate_member_stats_html(self, members_data):
         """Generate HTML for member statistics"""
         if not members_data:
             return "<p>No member data available</p>"
 
-        # Calculate statistics
-        total_members = len(members_data)
-        verified_count = sum(1 for m in members_data if m.get('is_verified', False))
-        bot_count = sum(1 for m in members_data if m.get('is_bot', False))
-        
+        total_members = members_data['total']
+        verified_count = members_data['verified']
+        bot_count = members_data['bots']
+
         return f"""
             <table>
                 <tr>
@@ -543,22 +3811,278 @@ class TelegramAnalyzer:
             </script>
         """
 
+    def _generate_media_stats_html(self, media_data):
+        """Generate HTML for media statistics"""
+        if not media_data:
+            return "<p>No media data available</p>"
+
+        sizes = media_data.get('sizes', {})
+        rows = "".join(
+            f"<tr><td>{escape(media_type.replace('_', ' ').title())}</td><td>{count}</td>"
+            f"<td>{f'{sizes[media_type] / 2 ** 20:,.1f} MB' if sizes.get(media_type) else ''}</td></tr>"
+            for media_type, count in media_data['counts'].items()
+        )
+        domain_rows = "".join(
+            f"<tr><td>{escape(str(domain))}</td><td>{count}</td></tr>"
+            for domain, count in media_data['top_domains']
+        )
+        return f"""
+            <table>
+                <tr>
+                    <th>Media Type</th>
+                    <th>Count</th>
+                    <th>Total Size</th>
+                </tr>
+                {rows}
+            </table>
+            <h3>Top Domains</h3>
+            <table>
+                <tr>
+                    <th>Domain</th>
+                    <th>Count</th>
+                </tr>
+                {domain_rows}
+            </table>
+        """
+
+    def _generate_network_stats_html(self, network_data):
+        """Generate HTML for network statistics"""
+        if not network_data:
+            return "<p>No network data available</p>"
+
+        rows = "".join(f"<tr><td>{escape(str(user))}</td><td>{score:.4f}</td></tr>"
+                       for user, score in network_data['top_influence'])
+        return f"""
+            <p>Interactions: {network_data['interactions']}</p>
+            <p>Communities: {network_data['communities']}</p>
+            <table>
+                <tr>
+                    <th>User</th>
+                    <th>Influence Score</th>
+                </tr>
+                {rows}
+            </table>
+        """
+
+    def _generate_content_stats_html(self, content_data):
+        """Generate HTML for content statistics"""
+        if not content_data:
+            return "<p>No content data available</p>"
+
+        sections = ""
+        for key, label in [('hashtags', 'Top Hashtags'), ('mentions', 'Top Mentions'),
+                           ('languages', 'Languages'), ('emoji_usage', 'Top Emoji')]:
+            # Items come from message text, so they are escaped before going into the page
+            rows = "".join(f"<tr><td>{escape(str(item))}</td><td>{count}</td></tr>" for item, count in content_data[key])
+            sections += f"""
+            <h3>{label}</h3>
+            <table>
+                <tr>
+                    <th>Item</th>
+                    <th>Count</th>
+                </tr>
+                {rows}
+            </table>
+            """
+        return sections
+
+def load_config(path):
+    """Option defaults from a JSON or TOML file, keyed by long option name ("rate_limit" or "rate-limit")
+
+    Besides the command line options it may hold the credentials (api_id,
+    api_hash, phone) and "plugins", a mapping of analyzer name to 'module:Class'.
+    """
+    with open(path, 'rb') as f:
+        if str(path).endswith('.toml'):
+            import tomllib
+            config = tomllib.load(f)
+        else:
+            config = json.load(f)
+    return {key.replace('-', '_'): value for key, value in config.items()}
+
+
 async def main():
-    # Your credentials
-    API_ID = ''
-    API_HASH = ''
-    PHONE = '+(COUNTRYCODE)'
+    # The config file supplies defaults for the options below, and plugins for --analyzers, so read it first
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument('--config', help="JSON or TOML file with option defaults, credentials and analyzer plugins")
+    config_args, _ = config_parser.parse_known_args()
+    config = load_config(config_args.config) if config_args.config else {}
+    for name, plugin in config.pop('plugins', {}).items():
+        register_analyzer(name, plugin)
+    credentials = {key: config.pop(key, None) for key in ('api_id', 'api_hash', 'phone')}
+
+    parser = argparse.ArgumentParser(description="Telegram group analytics", parents=[config_parser])
+    parser.add_argument('--replay', metavar='DUMP', help="analyze a recorded message dump offline")
+    parser.add_argument('--title', help="group name to use for the replayed dump")
+    parser.add_argument('--export', nargs=2, metavar=('STORE', 'DUMP'),
+                        help="write a group's messages.db store to a JSONL(.gz) dump")
+    parser.add_argument('--timezone', default='UTC', help="timezone for activity time series, e.g. Europe/Berlin")
+    parser.add_argument('--sketch-size', type=int,
+                        help="track keywords, hashtags, mentions and domains with bounded Space-Saving sketches")
+    parser.add_argument('--media-details', action='store_true',
+                        help="also write one line per media message and link to media_details.ndjson")
+    parser.add_argument('--merge-sketches', nargs='+', metavar=('OUTPUT', 'ANALYSIS'),
+                        help="merge the sketches of several *_analysis files into OUTPUT")
+    parser.add_argument('--groups', nargs='+', metavar='GROUP',
+                        help="analyze these groups (titles or ids) in one batch instead of choosing interactively")
+    parser.add_argument('--all-groups', action='store_true', help="analyze every group in the dialog list in one batch")
+    parser.add_argument('--concurrency', type=int, default=4, help="groups analyzed at the same time in batch mode")
+    parser.add_argument('--rate-limit', type=float, default=20, help="average Telegram API requests per second")
+    parser.add_argument('--no-store', action='store_true',
+                        help="scan the history directly instead of syncing it into the local message store")
+    parser.add_argument('--checkpoint-interval', type=float, default=300,
+                        help="seconds between scan checkpoints when running with --no-store (0 disables them)")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="with --no-store, fetch the history as this many concurrent message-id ranges")
+    parser.add_argument('--format', default='ndjson', choices=list(ARTIFACT_FORMATS),
+                        help="analysis file format; ndjson.zst needs the zstandard package")
+    parser.add_argument('--since', type=time_argument,
+                        help="only analyze messages from this ISO date/time (UTC) or span back from now, e.g. 30d, 12h, 2w")
+    parser.add_argument('--until', type=time_argument, help="only analyze messages before this date or span back from now")
+    parser.add_argument('--kind', choices=list(MESSAGE_KINDS), help="only analyze messages of this kind")
+    parser.add_argument('--sample', action='store_true',
+                        help="estimate from a random sample of the history, with confidence intervals, instead of reading all of it")
+    parser.add_argument('--sample-accuracy', type=float,
+                        help="with --sample, target relative error of the message count, e.g. 0.05 (the default)")
+    parser.add_argument('--sample-budget', type=float, help="with --sample, seconds to spend sampling one group")
+    parser.add_argument('--watch', action='store_true',
+                        help="with --groups or --all-groups, keep their analyses current from new, edited and deleted messages")
+    parser.add_argument('--snapshot-interval', type=float, default=60, help="seconds between saved snapshots in --watch mode")
+    parser.add_argument('--rebuild-interval', type=float, default=3600,
+                        help="in --watch mode, seconds between rebuilds from the store that apply edits and deletions")
+    parser.add_argument('--report', metavar='GROUP_DIR', help="regenerate the HTML report from a group's saved analysis")
+    parser.add_argument('--analyzers', nargs='+', choices=list(ANALYZERS), default=DEFAULT_ANALYZERS,
+                        help="analyzers to run; only their dependencies are loaded")
+    parser.add_argument('--output-dir', default='telegram_analysis', help="folder for the per-group results")
+    parser.add_argument('--no-charts', action='store_true', help="skip rendering chart images")
+    parser.add_argument('--session', help="Telethon session file to reuse (default: named after the phone number)")
+    parser.add_argument('--login', action='store_true',
+                        help="log in interactively and save the session for later non-interactive runs, then exit")
+    parser.add_argument('--analysis-workers', type=int, default=0,
+                        help="processes analyzing messages while they are fetched (0 analyzes in-process)")
+    parser.add_argument('--analysis-queue', type=int,
+                        help="batches of 1000 messages held between fetch and analysis (default: twice the workers)")
+    parser.add_argument('--chart-workers', type=int, help="processes rendering charts (0 renders inline)")
+    parser.add_argument('--chart-budget', type=float, default=60, help="seconds allowed per chart render")
+    parser.add_argument('--network-top-n', type=int, default=150, help="users drawn in the network graph, by PageRank")
+    unknown = set(config) - set(vars(parser.parse_args([])))
+    if unknown:
+        parser.error(f"unknown settings in {config_args.config}: {', '.join(sorted(unknown))}")
+    parser.set_defaults(**config)
+    args = parser.parse_args()
+    # argparse checks choices on the command line only, not on defaults from the config file
+    if isinstance(args.analyzers, str):
+        args.analyzers = [args.analyzers]
+    unknown = [name for name in args.analyzers if name not in ANALYZERS]
+    if unknown:
+        parser.error(f"unknown analyzers: {', '.join(unknown)} (available: {', '.join(sorted(ANALYZERS))})")
+    output_options = {
+        'output_dir': args.output_dir,
+        'analyzers': args.analyzers,
+        'charts': not args.no_charts,
+        'artifact_format': args.format
+    }
+    analyzer_options = {
+        'messages': {'timezone': args.timezone},
+        'media': {'sketch_size': args.sketch_size, 'spill': args.media_details},
+        'content': {'sketch_size': args.sketch_size}
+    }
+    chart_options = {
+        'workers': args.chart_workers,
+        'time_budget': args.chart_budget,
+        'network_top_n': args.network_top_n
+    }
+    pipeline_options = {
+        'workers': args.analysis_workers,
+        'queue_size': args.analysis_queue
+    } if args.analysis_workers else None
+    message_filter = MessageFilter.parse(args.since, args.until, args.kind)
+    sample_options = {'accuracy': args.sample_accuracy, 'time_budget': args.sample_budget} if args.sample else None
+
+    if args.merge_sketches:
+        output, *inputs = args.merge_sketches
+        merged = merge_sketch_files(inputs)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({key: sketch.to_dict() for key, sketch in merged.items()}, f, ensure_ascii=False, indent=4)
+        print(f"Merged sketches from {len(inputs)} files into {output}")
+        return
+
+    if args.export:
+        store = MessageStore(args.export[0])
+        try:
+            records = store.iter_records(since=message_filter.since, until=message_filter.until)
+            count = write_dump(filter(message_filter.matches, records), args.export[1])
+        finally:
+            store.close()
+        print(f"Exported {count} messages to {args.export[1]}")
+        return
+
+    if args.report:
+        analyzer = TelegramAnalyzer(None, None, None, output_dir=args.output_dir)
+        await analyzer.generate_report(args.report)
+        return
+
+    if args.watch and not (args.groups or args.all_groups):
+        print("--watch needs --groups or --all-groups")
+        sys.exit(2)
+
+    if args.replay:
+        analyzer = TelegramAnalyzer(None, None, None, analyzer_options=analyzer_options,
+                                    chart_options=chart_options, message_filter=message_filter,
+                                    pipeline_options=pipeline_options, **output_options)
+        group_dir = await analyzer.analyze_dump(args.replay, args.title)
+        await analyzer.generate_report(group_dir)
+        return
+
+    # Credentials come from the config file or the environment
+    api_id = credentials['api_id'] or os.environ.get('TELEGRAM_API_ID')
+    api_hash = credentials['api_hash'] or os.environ.get('TELEGRAM_API_HASH')
+    phone = credentials['phone'] or os.environ.get('TELEGRAM_PHONE')
+    if not (api_id and api_hash and (phone or args.session)):
+        print("Set api_id, api_hash and phone in the --config file or TELEGRAM_API_ID, TELEGRAM_API_HASH "
+              "and TELEGRAM_PHONE")
+        sys.exit(2)
 
     # Initialize analyzer
-    analyzer = TelegramAnalyzer(API_ID, API_HASH, PHONE)
-    
-    # Connect to Telegram
-    if not await analyzer.initialize():
-        print("Failed to initialize. Exiting...")
+    analyzer = TelegramAnalyzer(int(api_id), api_hash, phone, analyzer_options=analyzer_options,
+                                chart_options=chart_options, rate_limit=args.rate_limit,
+                                use_store=not args.no_store, checkpoint_interval=args.checkpoint_interval or None,
+                                shards=args.shards, message_filter=message_filter, sample_options=sample_options,
+                                pipeline_options=pipeline_options, session=args.session, **output_options)
+
+    # Connect to Telegram; batch and watch runs never prompt, they need a saved session
+    batch = bool(args.groups or args.all_groups)
+    if not await analyzer.initialize(interactive=args.login or not batch):
+        print("Failed to initialize. Exiting..." if not batch else
+              "Failed to connect with the saved session; run once with --login. Exiting...")
+        sys.exit(1)
+    if args.login:
+        print("Logged in; the session is saved for non-interactive runs")
+        await analyzer.client.disconnect()
         return
 
     # Get all groups
     groups = await analyzer.client.get_dialogs()
+
+    if batch:
+        wanted = set(args.groups or [])
+        selected = [dialog for dialog in groups if dialog.is_group and
+                    (args.all_groups or dialog.title in wanted or str(dialog.id) in wanted)]
+        missing = wanted - {dialog.title for dialog in selected} - {str(dialog.id) for dialog in selected}
+        for name in sorted(missing):
+            print(f"Group not found: {name}")
+        if args.watch:
+            try:
+                await analyzer.watch_groups(selected, snapshot_interval=args.snapshot_interval,
+                                            rebuild_interval=args.rebuild_interval)
+            finally:
+                await analyzer.client.disconnect()
+            return
+        results = await analyzer.analyze_groups(selected, concurrency=args.concurrency)
+        await analyzer.client.disconnect()
+        if missing or any(result['status'] != 'ok' for result in results):
+            sys.exit(1)
+        return
     print("\nAvailable groups:")
     for i, dialog in enumerate(groups):
         if dialog.is_group:
@@ -580,7 +4104,7 @@ async def main():
             await analyzer.analyze_group(selected_group)
             
             # Generate report
-            group_dir = f"{analyzer.output_dir}/{analyzer._clean_filename(selected_group.title)}"
+            group_dir = analyzer._group_dir(selected_group.title)
             await analyzer.generate_report(group_dir)
             
         except ValueError:
@@ -0,0 +1,218 @@
+"""Checks of the sketches, graph and sampling math, and of scan modes agreeing with a sequential scan
+
+Run with `python -m pytest`. The scan checks analyze benchmark.MessageGenerator
+histories through benchmark.FakeClient, so no Telegram account is needed.
+"""
+import asyncio
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from rich.console import Console
+
+import benchmark
+from main import (SpaceSaving, QuantileSketch, HistorySample, TelegramAnalyzer, _label_propagation,
+                  find_analysis, read_analysis)
+
+
+def zipf_stream(length, distinct, seed=0):
+    random_source = random.Random(seed)
+    weights = [1 / rank for rank in range(1, distinct + 1)]
+    return random_source.choices([f"item{rank}" for rank in range(distinct)], weights, k=length)
+
+
+def assert_space_saving_bounds(sketch, truth):
+    total = sum(truth.values())
+    assert sketch.total == total
+    for item, count, error in sketch.top():
+        assert count - error <= truth[item] <= count
+        assert error <= total / sketch.capacity
+    for item, true_count in truth.items():
+        if item not in sketch.counters:
+            assert true_count <= sketch.min_count()
+        # Heavy hitters above total / capacity are never evicted
+        if true_count > total / sketch.capacity:
+            assert item in sketch.counters
+
+
+def test_space_saving_bounds():
+    stream = zipf_stream(20000, 500)
+    sketch = SpaceSaving(50)
+    sketch.update(stream)
+    assert len(sketch) == 50
+    assert_space_saving_bounds(sketch, Counter(stream))
+
+
+def test_space_saving_merge_bounds():
+    stream = zipf_stream(30000, 800, seed=1)
+    parts = [stream[:7000], stream[7000:19000], stream[19000:]]
+    sketches = []
+    for part in parts:
+        sketch = SpaceSaving(60)
+        sketch.update(part)
+        sketches.append(sketch)
+    merged = sketches[0].merge(sketches[1]).merge(sketches[2])
+    assert len(merged) <= 60
+    assert_space_saving_bounds(merged, Counter(stream))
+
+
+def test_space_saving_exact_below_capacity_and_ties_by_item():
+    first, second = SpaceSaving(10), SpaceSaving(10)
+    first.update(['b', 'a', 'c', 'a', 'b'])
+    second.update(['a', 'b', 'c', 'b', 'a'])
+    assert first.top() == second.top() == [('a', 2, 0), ('b', 2, 0), ('c', 1, 0)]
+    assert first.most_common(2) == [('a', 2), ('b', 2)]
+
+
+def test_space_saving_round_trips_through_dict():
+    sketch = SpaceSaving(20)
+    sketch.update(zipf_stream(2000, 100, seed=2))
+    restored = SpaceSaving.from_dict(sketch.to_dict())
+    assert restored.top() == sketch.top()
+    assert restored.total == sketch.total
+
+
+@pytest.mark.parametrize('accuracy', [0.01, 0.05])
+def test_quantile_sketch_relative_error(accuracy):
+    values = np.random.default_rng(0).lognormal(mean=10, sigma=2, size=20000)
+    sketch = QuantileSketch(accuracy)
+    for value in values:
+        sketch.add(float(value))
+    ordered = np.sort(values)
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= accuracy * exact * (1 + 1e-9)
+    assert sketch.quantile(0) == pytest.approx(ordered[0], rel=accuracy)
+    assert sketch.to_dict()['max'] == ordered[-1]
+
+
+def test_quantile_sketch_merge_is_exact():
+    values = np.random.default_rng(1).exponential(1000, size=5000)
+    whole, first, second = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    for index, value in enumerate(values):
+        whole.add(float(value))
+        (first if index % 3 else second).add(float(value))
+    first.merge(second)
+    assert first.buckets == whole.buckets
+    assert first.to_dict() == whole.to_dict()
+
+
+def test_label_propagation_separates_weakly_linked_cliques():
+    import scipy.sparse as sp
+    edges = [(a, b, 5.0) for group in ([0, 1, 2, 3], [4, 5, 6, 7]) for a in group for b in group if a < b]
+    edges.append((3, 4, 1.0))
+    rows, cols, weights = zip(*edges)
+    matrix = sp.coo_matrix((weights, (rows, cols)), shape=(8, 8)).tocsr()
+    labels = _label_propagation(matrix + matrix.T)
+    assert len(set(labels[:4])) == 1
+    assert len(set(labels[4:])) == 1
+    assert labels[0] != labels[4]
+
+
+def window_counts(min_id, max_id, present):
+    """Counts of one sampled window of a history whose existing ids are `present`"""
+    ids = [message_id for message_id in range(min_id + 1, max_id) if message_id in present]
+    return Counter(messages=len(ids), polarity=sum(message_id % 7 for message_id in ids) / 10, scored=len(ids))
+
+
+def history(size=5000, deleted=0.3, seed=0):
+    random_source = random.Random(seed)
+    return {message_id for message_id in range(1, size + 1) if random_source.random() >= deleted}
+
+
+def test_history_sample_census_is_exact():
+    present = history()
+    sample = HistorySample(0, 5000, window=50, strata=10, seed=0)
+    while windows := sample.draw():
+        for stratum, min_id, max_id in windows:
+            sample.add(stratum, window_counts(min_id, max_id, present))
+    total = sample.total('messages')
+    assert total['estimate'] == total['low'] == total['high'] == len(present)
+    ratio = sample.ratio('polarity', 'scored')
+    assert ratio['estimate'] == pytest.approx(sum(message_id % 7 for message_id in present) / 10 / len(present),
+                                              abs=1e-4)
+    assert ratio['low'] == pytest.approx(ratio['high'])
+    assert sample.relative_error() == 0
+
+
+def test_history_sample_intervals_cover_the_true_total():
+    present = history(seed=1)
+    covered = 0
+    trials = 200
+    for seed in range(trials):
+        sample = HistorySample(0, 5000, window=50, strata=10, seed=seed)
+        for _ in range(3):
+            for stratum, min_id, max_id in sample.draw():
+                sample.add(stratum, window_counts(min_id, max_id, present))
+        total = sample.total('messages')
+        covered += total['low'] <= len(present) <= total['high']
+    # Nominal 95%; few windows per stratum make the normal interval a little narrow
+    assert covered / trials >= 0.88
+
+
+def test_history_sample_rounds_needed_scales_with_the_square_of_the_error():
+    present = history(seed=2)
+    sample = HistorySample(0, 5000, window=50, strata=10, seed=3)
+    for _ in range(4):
+        for stratum, min_id, max_id in sample.draw():
+            sample.add(stratum, window_counts(min_id, max_id, present))
+    error = sample.relative_error()
+    assert 0 < error < float('inf')
+    assert sample.rounds_needed(error) == sample.rounds
+    assert sample.rounds_needed(error / 2) in (4 * sample.rounds, 4 * sample.rounds + 1)
+
+
+def analyze(output_dir, **options):
+    analyzer = TelegramAnalyzer(None, None, None, output_dir=output_dir, rate_limit=None, charts=False,
+                                checkpoint_interval=None, **options)
+    analyzer.console = Console(quiet=True)
+    analyzer.client = benchmark.FakeClient(benchmark.MessageGenerator(1500, seed=3))
+    asyncio.run(analyzer.analyze_group(SimpleNamespace(id=1, title='group')))
+    group_dir = f"{output_dir}/group"
+    return {name: read_analysis(find_analysis(group_dir, name)) for name in ['messages', 'media', 'network', 'content']}
+
+
+def canonical(value, path=()):
+    """Analysis data with the lists kept in scan order sorted"""
+    if isinstance(value, dict):
+        return {key: canonical(item, path + (key,)) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [canonical(item, path) for item in value]
+        # Per-message records follow the scan direction, newest first or oldest first
+        if 'reply_patterns' in path or path[-1:] == ('interactions',):
+            items.sort(key=repr)
+        return items
+    return value
+
+
+def assert_same(value, expected, path=''):
+    """Equal data, floats up to the rounding of summing in another order"""
+    if isinstance(expected, dict):
+        assert isinstance(value, dict) and value.keys() == expected.keys(), path
+        for key in expected:
+            assert_same(value[key], expected[key], f"{path}/{key}")
+    elif isinstance(expected, list):
+        assert isinstance(value, list) and len(value) == len(expected), path
+        for index, (item, expected_item) in enumerate(zip(value, expected)):
+            assert_same(item, expected_item, f"{path}[{index}]")
+    elif isinstance(expected, float):
+        assert value == pytest.approx(expected, rel=1e-9, abs=1e-12), path
+    else:
+        assert value == expected, path
+
+
+@pytest.fixture(scope='module')
+def sequential(tmp_path_factory):
+    return canonical(analyze(str(tmp_path_factory.mktemp('sequential')), use_store=False))
+
+
+@pytest.mark.parametrize('options', [
+    {'use_store': True},
+    {'use_store': False, 'shards': 3},
+    {'use_store': False, 'pipeline_options': {'workers': 2}},
+    {'use_store': True, 'pipeline_options': {'workers': 2}},
+], ids=['store', 'sharded', 'pipelined', 'store-pipelined'])
+def test_scan_modes_match_a_sequential_scan(tmp_path, sequential, options):
+    assert_same(canonical(analyze(str(tmp_path), **options)), sequential)